@@ -0,0 +1,124 @@
+#
+# accessibility.py
+#
+# Capture backend built on the CDP accessibility tree (Accessibility.getFullAXTree).
+# Much smaller than a DOMSnapshot for Q&A: only roles, names and values, already
+# computed by the browser, serialized into the same <link id=..> lines.
+#
+
+from snapshot import ElementIds, format_element
+
+# AX role -> serialized element name; every other role only contributes its text children
+ax_roles = {
+	"link": "link",
+	"button": "button",
+	"menuitem": "button",
+	"tab": "button",
+	"checkbox": "button",
+	"radio": "button",
+	"switch": "button",
+	"textbox": "input",
+	"searchbox": "input",
+	"combobox": "input",
+	"img": "img",
+	"image": "img",
+	"StaticText": "text",
+}
+
+# links and buttons get their accessible name from their contents, so those aren't repeated as text
+folds_children = set(["link", "button"])
+
+
+# JSON bytes of an AX node besides its texts: ids, flags, the role/name wrappers, properties and name sources
+ax_node_overhead = 300
+
+
+def ax_payload_estimate(ax_tree):
+	"""
+	Approximate JSON size in bytes of a getFullAXTree response, like snapshot.payload_estimate: a fixed overhead
+	per node plus the text of roles, names and values, without serializing it.
+	"""
+	nodes = ax_tree["nodes"]
+	size = ax_node_overhead * len(nodes)
+	for key in ("role", "name", "value"):
+		size += sum(len(str(node[key].get("value", ""))) for node in nodes if key in node)
+	return size
+
+
+def capture_ax_tree(client, log_size=True):
+	"""Accessibility.getFullAXTree over CDP session `client`."""
+	client.send("Accessibility.enable")
+	ax_tree = client.send("Accessibility.getFullAXTree")
+	if log_size:
+		print("AX tree payload: ~{:0.1f} KB, {} nodes".format(ax_payload_estimate(ax_tree) / 1024, len(ax_tree["nodes"])))
+	return ax_tree
+
+
+class AXElement:
+	"""page_element_buffer entry for an AX node. There are no boxes in the AX tree, only the DOM node behind it."""
+
+	__slots__ = ("backend_node_id", "node_name", "node_value")
+
+	def __init__(self, backend_node_id, node_name, node_value):
+		self.backend_node_id = backend_node_id
+		self.node_name = node_name
+		self.node_value = node_value
+
+	def __repr__(self):
+		return f"AXElement({self.node_name!r}, backend_node_id={self.backend_node_id})"
+
+
+def _property(node, key):
+	value = node.get(key)
+	if not value:
+		return ""
+	return str(value.get("value", "")).strip()
+
+
+def iter_ax_serialized(ax_tree, page_element_buffer, element_ids=None):
+	"""Lines in the DOMSnapshot serializer's format for an AX tree, in document order (iterative walk from the root)."""
+	if element_ids is None:
+		element_ids = ElementIds()
+
+	nodes = {node["nodeId"]: node for node in ax_tree["nodes"]}
+	roots = [node["nodeId"] for node in ax_tree["nodes"] if "parentId" not in node or node["parentId"] not in nodes]
+
+	# (node id, inside a link/button)
+	stack = [(node_id, False) for node_id in reversed(roots)]
+	while stack:
+		node_id, folded = stack.pop()
+		node = nodes.get(node_id)
+		if node is None:
+			continue
+
+		role = _property(node, "role")
+		node_name = None if node.get("ignored") else ax_roles.get(role)
+		children_folded = folded or role in folds_children
+		stack.extend((child_id, children_folded) for child_id in reversed(node.get("childIds", [])))
+
+		if node_name is None or (folded and node_name == "text"):
+			continue
+
+		name = _property(node, "name")
+		value = _property(node, "value")
+		if node_name == "text":
+			parts = ("text", "", name) if name not in ("", "|", "•") else None
+		elif node_name == "input":
+			parts = ("input", f" {name}" if name else "", value)
+		elif node_name == "img":
+			parts = ("img", f" {name}" if name else "", "")
+		elif node_name == "button" and not name:
+			parts = None
+		else:
+			parts = (node_name, "", name)
+		if parts is None:
+			continue
+
+		backend_node_id = node.get("backendDOMNodeId")
+		if backend_node_id is not None and backend_node_id in element_ids:
+			element_ids.duplicates += 1
+			continue
+		element_id = len(element_ids)
+		element_ids.assign(backend_node_id if backend_node_id is not None else ("ax", node_id))
+		page_element_buffer[element_id] = AXElement(backend_node_id, node_name, parts[2])
+		yield format_element(parts, element_id)
@@ -0,0 +1,358 @@
+#
+# bench.py
+#
+# Benchmarks for the snapshot parser: offline fixture replays, plus a live
+# comparison of the DOMSnapshot and accessibility-tree capture backends.
+#
+#   python bench.py --record https://www.amityregion5.org/directory fixtures/amity.json.gz
+#   python bench.py fixtures/amity.json.gz
+#   python bench.py --synthetic 10000 100000 1000000
+#   python bench.py --compare https://www.amityregion5.org/directory
+#
+
+import argparse
+import gzip
+import json
+import random
+import time
+import tracemalloc
+
+from accessibility import capture_ax_tree, iter_ax_serialized
+from content import content_masks
+from snapshot import ElementIds, IncrementalSerializer, Snapshot, Viewport, black_listed_elements, capture_snapshot, page_metrics, extract_elements, serialize_elements, iter_serialized
+from tokens import TokenCounter
+
+fixture_version = 1
+
+# output sizes are reported in the tokens of the model the crawlers prompt
+token_counter = TokenCounter("text-davinci-003")
+
+
+def save_fixture(path, tree, metrics, url="", ax_tree=None):
+	"""Writes a raw captureSnapshot response plus window metrics (and optionally the AX tree) as gzipped JSON."""
+	fixture = {"version": fixture_version, "url": url, "metrics": metrics, "snapshot": tree}
+	if ax_tree is not None:
+		fixture["ax_tree"] = ax_tree
+	with gzip.open(path, "wt", encoding="utf-8") as f:
+		json.dump(fixture, f)
+
+
+def load_fixture(path):
+	"""
+	Returns (tree, metrics, ax_tree) from a file written by save_fixture; ax_tree (the Accessibility.getFullAXTree
+	response) is None for fixtures recorded without one.
+	"""
+	with gzip.open(path, "rt", encoding="utf-8") as f:
+		fixture = json.load(f)
+	if fixture.get("version") != fixture_version:
+		raise ValueError(f"{path}: unsupported fixture version {fixture.get('version')}")
+	return fixture["snapshot"], fixture["metrics"], fixture.get("ax_tree")
+
+
+def record(url, path):
+	# playwright is only needed to record, replaying works without a browser
+	from playwright.sync_api import sync_playwright
+
+	with sync_playwright() as playwright:
+		browser = playwright.chromium.launch(headless=True)
+		page = browser.new_page()
+		page.goto(url=url if "://" in url else "http://" + url)
+		client = page.context.new_cdp_session(page)
+		metrics = page_metrics(page)
+		# fixtures keep every field, so replays can try parsers that read more than today's
+		tree = capture_snapshot(client, "full")
+		ax_tree = capture_ax_tree(client)
+		browser.close()
+
+	save_fixture(path, tree, metrics, url=url, ax_tree=ax_tree)
+	print(f"Recorded {url} -> {path}")
+
+
+def synthetic_tree(node_count, seed=0):
+	"""
+	A captureSnapshot-shaped response for a staff-directory-like page of roughly `node_count` nodes:
+	a nav bar, a search form, then table rows of name link / title / phone, with some hidden rows.
+	"""
+	rnd = random.Random(seed)
+	strings = []
+	string_ids = {}
+
+	def string(value):
+		if value not in string_ids:
+			string_ids[value] = len(strings)
+			strings.append(value)
+		return string_ids[value]
+
+	parent_index = []
+	node_name = []
+	node_value = []
+	attributes = []
+	clickable = []
+	layout_node_index = []
+	bounds = []
+
+	def add(name, parent, value=None, attrs=(), box=None, is_clickable=False):
+		index = len(parent_index)
+		parent_index.append(parent)
+		node_name.append(string(name))
+		node_value.append(-1 if value is None else string(value))
+		attributes.append([string(item) for item in attrs])
+		if box is not None:
+			layout_node_index.append(index)
+			bounds.append(list(box))
+		if is_clickable:
+			clickable.append(index)
+		return index
+
+	titles = ["Principal", "Assistant Principal", "School Counselor", "Teacher", "Secretary", "Nurse", "Librarian"]
+
+	document = add("#document", -1)
+	html = add("HTML", document, box=(0, 0, 1280, 800))
+	head = add("HEAD", html)
+	add("TITLE", head)
+	add("SCRIPT", head)
+	body = add("BODY", html, box=(0, 0, 1280, 800))
+
+	nav = add("NAV", body, box=(0, 0, 1280, 60))
+	for item in range(12):
+		link = add("A", nav, attrs=("href", f"/page{item}"), box=(item * 100, 10, 90, 30))
+		add("#text", link, value=f"Menu {item}", box=(item * 100, 10, 80, 20))
+
+	form = add("FORM", body, box=(0, 60, 1280, 40))
+	add("INPUT", form, attrs=("type", "text", "placeholder", "Search staff"), box=(10, 65, 300, 30))
+	add("INPUT", form, attrs=("type", "submit", "aria-label", "Search"), box=(320, 65, 80, 30))
+
+	table = add("TABLE", body, box=(0, 100, 1280, 0))
+	tbody = add("TBODY", table, box=(0, 100, 1280, 0))
+	row = 0
+	while len(parent_index) < node_count:
+		y = 100 + row * 40
+		hidden = rnd.random() < 0.05
+		row_box = None if hidden else (0, y, 1280, 40)
+		tr = add("TR", tbody, box=row_box)
+
+		td = add("TD", tr, box=None if hidden else (0, y, 400, 40))
+		link = add("A", td, attrs=("href", f"mailto:staff{row}@example.org", "title", "Email"), box=None if hidden else (0, y, 200, 20))
+		add("#text", link, value=f"Staff Member {row}", box=None if hidden else (0, y, 200, 20))
+
+		td = add("TD", tr, box=None if hidden else (400, y, 400, 40))
+		add("#text", td, value=rnd.choice(titles), box=None if hidden else (400, y, 200, 20))
+
+		td = add("TD", tr, box=None if hidden else (800, y, 400, 40))
+		add("#text", td, value=f"(203) 555-{row % 10000:04d}", box=None if hidden else (800, y, 150, 20))
+		if rnd.random() < 0.1:
+			add("SPAN", td, value=None, box=None if hidden else (950, y, 20, 20), is_clickable=True)
+		row += 1
+
+	size = len(parent_index)
+	return {
+		"documents": [{
+			"documentURL": string("https://example.org/staff-directory"),
+			"nodes": {
+				"parentIndex": parent_index,
+				"nodeType": [1] * size,
+				"nodeName": node_name,
+				"nodeValue": node_value,
+				"backendNodeId": list(range(1, size + 1)),
+				"attributes": attributes,
+				"textValue": {"index": [], "value": []},
+				"inputValue": {"index": [], "value": []},
+				"inputChecked": {"index": []},
+				"isClickable": {"index": clickable},
+			},
+			"layout": {
+				"nodeIndex": layout_node_index,
+				"styles": [[] for _ in layout_node_index],
+				"bounds": bounds,
+				"text": [-1] * len(layout_node_index),
+				"stackingContexts": {"index": []},
+				"paintOrders": list(range(len(layout_node_index))),
+			},
+			"textBoxes": {"layoutIndex": [], "bounds": [], "start": [], "length": []},
+		}],
+		"strings": strings,
+	}
+
+
+synthetic_metrics = {
+	"device_pixel_ratio": 1,
+	"scroll_x": 0,
+	"scroll_y": 0,
+	"width": 1280,
+	"height": 800,
+	"inner_width": 1280,
+	"inner_height": 720,
+	"scroll_height": 800,
+	"offset_height": 800,
+}
+
+
+def run_stages(tree, metrics, viewport):
+	"""
+	Runs the crawlers' parse stages once. Returns ({stage: seconds}, lines), lines being natbot.py's output.
+	columns and cull are shared; extract + serialize is natbot.py, agent is Crawler.crawl, content + qa is
+	Crawler2.crawl (main region, no nav links) and delta is a Crawler.crawl_delta step on an unchanged page,
+	its own columns and cull included.
+	"""
+	timings = {}
+
+	start = time.perf_counter()
+	snapshot = Snapshot(tree, metrics["device_pixel_ratio"])
+	timings["columns"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	mask = snapshot.cull(viewport, metrics) & ~snapshot.name_mask(black_listed_elements)
+	timings["cull"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	elements_in_view_port, child_nodes = extract_elements(snapshot, mask)
+	timings["extract"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	lines = serialize_elements(elements_in_view_port, child_nodes, {})
+	timings["serialize"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	list(iter_serialized(snapshot, mask, {}))
+	timings["agent"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	main, nav = content_masks(snapshot, mask)
+	timings["content"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	element_ids = ElementIds()
+	list(iter_serialized(snapshot, main, {}, element_ids))
+	list(iter_serialized(snapshot, nav, {}, element_ids))
+	timings["qa"] = time.perf_counter() - start
+
+	incremental = IncrementalSerializer()
+	list(incremental.serialize(snapshot, mask, {}))
+	start = time.perf_counter()
+	step = Snapshot(tree, metrics["device_pixel_ratio"])
+	step_mask = step.cull(viewport, metrics) & ~step.name_mask(black_listed_elements)
+	list(incremental.serialize(step, step_mask, {}))
+	timings["delta"] = time.perf_counter() - start
+
+	return timings, lines
+
+
+def benchmark(name, tree, metrics, viewport, repeat=3, measure_memory=True):
+	node_count = sum(len(document["nodes"]["parentIndex"]) for document in tree["documents"])
+
+	runs = [run_stages(tree, metrics, viewport) for _ in range(repeat)]
+	# best of N per stage, the usual way to keep scheduler noise out of small timings
+	timings = {stage: min(run[0][stage] for run in runs) for stage in runs[0][0]}
+	lines = runs[0][1]
+
+	peak = None
+	if measure_memory:
+		tracemalloc.start()
+		run_stages(tree, metrics, viewport)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+	stages = "  ".join(f"{stage} {seconds * 1000:8.1f}ms" for stage, seconds in timings.items())
+	memory = f"{peak / 2 ** 20:7.1f}MiB" if peak is not None else "      -"
+	print(
+		f"{name:<28} nodes {node_count:>8}  {stages}"
+		f"  peak {memory}  out {len(lines):>6} lines {sum(map(len, lines)):>9} chars"
+	)
+	return timings, peak, lines
+
+
+def benchmark_ax(name, ax_tree, repeat=3):
+	"""Parse-only timing of the accessibility backend for a recorded AX tree."""
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		lines = list(iter_ax_serialized(ax_tree, {}))
+		timings.append(time.perf_counter() - start)
+	tokens = token_counter.count("\n".join(lines))
+	print(
+		f"{name + ' [ax]':<28} nodes {len(ax_tree['nodes']):>8}  parse {min(timings) * 1000:8.1f}ms"
+		f"  out {len(lines):>6} lines {sum(map(len, lines)):>9} chars {tokens:>7} tokens"
+	)
+	return lines
+
+
+def compare_backends(url, repeat=3):
+	"""
+	Live comparison of the DOMSnapshot and accessibility-tree Q&A backends on one page:
+	best-of-N capture and parse time, node count, output size and approximate tokens.
+	"""
+	from playwright.sync_api import sync_playwright
+
+	def dom(client, metrics):
+		start = time.perf_counter()
+		tree = capture_snapshot(client, "qa", log_size=False)
+		captured = time.perf_counter()
+		snapshot = Snapshot(tree, metrics["device_pixel_ratio"])
+		mask = snapshot.cull(Viewport.full_page(), metrics) & ~snapshot.name_mask(black_listed_elements)
+		lines = list(iter_serialized(snapshot, mask, {}))
+		return captured - start, time.perf_counter() - captured, snapshot.size, lines
+
+	def ax(client, metrics):
+		start = time.perf_counter()
+		ax_tree = capture_ax_tree(client, log_size=False)
+		captured = time.perf_counter()
+		lines = list(iter_ax_serialized(ax_tree, {}))
+		return captured - start, time.perf_counter() - captured, len(ax_tree["nodes"]), lines
+
+	with sync_playwright() as playwright:
+		browser = playwright.chromium.launch(headless=True)
+		page = browser.new_page()
+		page.goto(url=url if "://" in url else "http://" + url)
+		client = page.context.new_cdp_session(page)
+		metrics = page_metrics(page)
+		for name, backend in (("dom", dom), ("ax", ax)):
+			runs = [backend(client, metrics) for _ in range(repeat)]
+			capture = min(run[0] for run in runs)
+			parse = min(run[1] for run in runs)
+			node_count, lines = runs[0][2], runs[0][3]
+			tokens = token_counter.count("\n".join(lines))
+			print(
+				f"{name:<4} nodes {node_count:>8}  capture {capture * 1000:8.1f}ms  parse {parse * 1000:8.1f}ms"
+				f"  out {len(lines):>6} lines {sum(map(len, lines)):>9} chars {tokens:>7} tokens"
+			)
+		browser.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Replay DOMSnapshot fixtures through the crawler's parser.")
+	parser.add_argument("fixtures", nargs="*", help="fixture files written by --record")
+	parser.add_argument("--record", nargs=2, metavar=("URL", "PATH"), help="capture URL into a fixture and exit")
+	parser.add_argument("--compare", metavar="URL", help="compare the DOMSnapshot and accessibility-tree backends live on URL and exit")
+	parser.add_argument("--synthetic", nargs="*", type=int, metavar="NODES", help="also run synthetic pages of these sizes (default 10000 100000 1000000)")
+	parser.add_argument("--viewport", choices=["current", "full"], default="full", help="culling policy used for replay")
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--no-memory", action="store_true", help="skip the (slower) tracemalloc pass")
+	args = parser.parse_args()
+
+	if args.record:
+		record(*args.record)
+		return
+	if args.compare:
+		compare_backends(args.compare, args.repeat)
+		return
+
+	viewport = Viewport.full_page() if args.viewport == "full" else Viewport.current()
+	sizes = args.synthetic
+	if sizes is not None and len(sizes) == 0:
+		sizes = [10000, 100000, 1000000]
+	if not args.fixtures and sizes is None:
+		sizes = [10000, 100000, 1000000]
+
+	for path in args.fixtures:
+		tree, metrics, ax_tree = load_fixture(path)
+		benchmark(path, tree, metrics, viewport, args.repeat, not args.no_memory)
+		if ax_tree is not None:
+			benchmark_ax(path, ax_tree, args.repeat)
+
+	for size in sizes or []:
+		tree = synthetic_tree(size)
+		benchmark(f"synthetic-{size}", tree, synthetic_metrics, viewport, args.repeat, not args.no_memory)
+
+
+if __name__ == "__main__":
+	main()
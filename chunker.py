@@ -0,0 +1,87 @@
+#
+# chunker.py
+#
+# Splits serialized page lines into prompt-sized chunks without cutting an element
+# line, or a directory row (name, title, phone), across two chunks.
+#
+
+import numpy as np
+
+
+def line_groups(snapshot, rows, page_element_buffer, line_count):
+	"""
+	Per serialized line, the record row (extractor.record_rows) its element belongs to, or None.
+	Element ids are the line numbers, as iter_serialized assigns them; elements without a node_index
+	(the AX backend) are never grouped.
+	"""
+	if len(rows) == 0:
+		return [None] * line_count
+	row_nodes = np.array([row for row, _ in rows], dtype=np.int64)
+	row_ends = np.asarray(snapshot.subtree_end(), dtype=np.int64)[row_nodes]
+	nodes = np.array([
+		getattr(page_element_buffer.get(element_id), "node_index", -1) for element_id in range(line_count)
+	], dtype=np.int64)
+
+	# rows never nest, so the closest row starting at or before a node is the only one that can hold it
+	position = np.searchsorted(row_nodes, nodes, side="right") - 1
+	inside = (nodes >= 0) & (position >= 0) & (nodes <= row_ends[np.maximum(position, 0)])
+	return [row if is_inside else None for row, is_inside in zip(row_nodes[np.maximum(position, 0)].tolist(), inside.tolist())]
+
+
+def _units(lines, budget, groups, counter):
+	# runs of lines that should stay in one chunk, as (joined text, cost) no costlier than budget;
+	# costs are chars, or tokens with a counter (joined lines add one token per newline)
+	measure = len if counter is None else counter.count_line
+	runs = []
+	for index, line in enumerate(lines):
+		group = None if groups is None else groups[index]
+		if runs and group is not None and runs[-1][0] == group:
+			runs[-1][1].append(line)
+		else:
+			runs.append((group, [line]))
+
+	for _, run in runs:
+		costs = [measure(line) for line in run]
+		cost = sum(costs) + len(run) - 1
+		if cost <= budget:
+			yield "\n".join(run), cost
+			continue
+		# a group too large for one chunk is split between its lines, and only an oversized line itself is cut
+		for line, line_cost in zip(run, costs):
+			if line_cost <= budget:
+				yield line, line_cost
+			elif counter is None:
+				for start in range(0, len(line), budget):
+					yield line[start:start + budget], len(line[start:start + budget])
+			else:
+				for piece in counter.split(line, budget):
+					yield piece, counter.count(piece)
+
+
+def chunk_lines(lines, budget=5500, groups=None, overlap=0, counter=None):
+	"""
+	Packs whole lines into "\n"-joined chunks of at most `budget` chars, or tokens when a tokens.TokenCounter
+	is given. Consecutive lines sharing a group (see line_groups) stay in the same chunk unless the group alone
+	is over budget. Every chunk after the first repeats the trailing lines or groups of the previous one,
+	up to `overlap` (same unit as the budget).
+	"""
+	chunks = []
+	current = []
+	size = 0
+	for unit, cost in _units(lines, budget, groups, counter):
+		if current and size + 1 + cost > budget:
+			chunks.append("\n".join(text for text, _ in current))
+			carried = []
+			carried_size = -1
+			for previous, previous_cost in reversed(current[1:]):
+				if carried_size + 1 + previous_cost > overlap or carried_size + 1 + previous_cost + 1 + cost > budget:
+					break
+				carried.insert(0, (previous, previous_cost))
+				carried_size += 1 + previous_cost
+			current = carried
+			size = max(carried_size, 0)
+		size += cost + (1 if current else 0)
+		current.append((unit, cost))
+	if current:
+		chunks.append("\n".join(text for text, _ in current))
+	return chunks
@@ -1,7 +1,7 @@
 from playwright.sync_api import sync_playwright
 import time
 import sys
-from sys import argv, exit, platform 
+from sys import argv, exit
 import openai
 import os
 from dotenv import load_dotenv, find_dotenv
@@ -9,6 +9,16 @@ from ast import literal_eval
 import pandas as pd
 import numpy as np
 import re
+from concurrent.futures import ThreadPoolExecutor
+from accessibility import capture_ax_tree, iter_ax_serialized
+from content import content_masks
+from chunker import chunk_lines, line_groups
+from extractor import extract_records, record_rows, record_summary
+from llm_cache import create_completion, default_cache
+from parse_pool import ParsePool
+from ranking import select_chunks
+from snapshot import ElementIds, IncrementalSerializer, Snapshot, Viewport, black_listed_elements, capture_snapshot, page_metrics, iter_serialized
+from tokens import TokenCounter, take_within_tokens
 
 quiet = True
 if len(argv) >= 2:
@@ -142,7 +152,8 @@ PREVIOUS COMMAND: $previous_command
 YOUR COMMAND:
 """
 
-black_listed_elements = set(["html", "head", "title", "meta", "iframe", "body", "script", "style", "path", "svg", "br", "::marker",])
+# shared by every prompt, so element token counts are cached across crawls
+token_counter = TokenCounter("text-davinci-003")
 
 class Crawler:
 
@@ -154,11 +165,14 @@ class Crawler:
 		self.browser = self.playwright.chromium.launch(headless=False)
 		self.page = self.browser.new_context().new_page()
 		self.url = ""
+		# previous crawl_delta() of the current page, so the next one only re-parses what changed
+		self.incremental = IncrementalSerializer()
 
 	def go_to_page(self, url):
 		self.page.goto(url=url if "://" in url else "http://" + url)
 		self.client = self.page.context.new_cdp_session(self.page)
 		self.page_element_buffer = {}
+		self.incremental.reset()
 
 	def scroll(self, direction):
 		if direction == "up":
@@ -182,8 +196,8 @@ class Crawler:
 
 		element = self.page_element_buffer.get(int(id))
 		if element:
-			x = element.get("center_x")
-			y = element.get("center_y")
+			x = element.center_x
+			y = element.center_y
 			
 			self.page.mouse.click(x, y)
 		else:
@@ -196,27 +210,29 @@ class Crawler:
 	def enter(self):
 		self.page.keyboard.press("Enter")
 
-	def crawl(self):
+	def crawl(self, viewport=Viewport.current(), main_content=False, nav_links=25):
+		start = time.time()
+		elements_of_interest = list(self.iter_crawl(viewport, main_content, nav_links))
+		print("Parsing time: {:0.2f} seconds".format(time.time() - start))
+		return elements_of_interest
+
+	def crawl_delta(self, viewport=Viewport.current(), main_content=False, nav_links=25):
+		# only what changed since the previous crawl_delta(): {"added": [lines], "changed": [lines], "removed": [backend_node_ids]}
+		# opt-in: diffing costs about as much as the fresh parse crawl() does, so it only pays off for the delta itself
+		list(self.iter_crawl(viewport, main_content, nav_links, incremental=True))
+		return self.incremental.delta
+
+	def iter_crawl(self, viewport=Viewport.current(), main_content=False, nav_links=25, incremental=False):
+		# generator version of crawl(): yields the <url> line, then each element as soon as it is serialized
+		# with main_content, the detected main region comes first, followed by up to nav_links links and every
+		# form control / clickable from the rest (off by default: the region is often below the current viewport)
 		page = self.page
 		page_element_buffer = self.page_element_buffer
-		start = time.time()
 
 		page_state_as_text = []
 
-		device_pixel_ratio = page.evaluate("window.devicePixelRatio")
-		if platform == "darwin" and device_pixel_ratio == 1:  # lies
-			device_pixel_ratio = 2
-
-		win_scroll_x 		= page.evaluate("window.scrollX")
-		win_scroll_y 		= page.evaluate("window.scrollY")
-		win_upper_bound 	= page.evaluate("window.pageYOffset")
-		win_left_bound 		= page.evaluate("window.pageXOffset") 
-		win_width 			= page.evaluate("window.screen.width")
-		win_height 			= page.evaluate("window.screen.height")
-		win_right_bound 	= win_left_bound + win_width
-		win_lower_bound 	= win_upper_bound + win_height
-		# document_offset_height = page.evaluate("document.body.offsetHeight")
-		document_scroll_height = page.evaluate("document.body.scrollHeight")
+		# one round trip for all window/document metrics instead of one evaluate per value
+		metrics = page_metrics(page)
 
 		percentage_progress_start = 1
 		percentage_progress_end = 2
@@ -231,295 +247,25 @@ class Crawler:
 			}
 		)
 
-		tree = self.client.send(
-			"DOMSnapshot.captureSnapshot",
-			{"computedStyles": [], "includeDOMRects": True, "includePaintOrder": True},
-		)
-		strings	 	= tree["strings"]
-		url = tree["strings"][0]
-		# print("url", url)
-		document 	= tree["documents"][0]
-		nodes 		= document["nodes"]
-		backend_node_id = nodes["backendNodeId"]
-		attributes 	= nodes["attributes"]
-		node_value 	= nodes["nodeValue"]
-		parent 		= nodes["parentIndex"]
-		node_types 	= nodes["nodeType"]
-		node_names 	= nodes["nodeName"]
-		is_clickable = set(nodes["isClickable"]["index"])
-
-		text_value 			= nodes["textValue"]
-		text_value_index 	= text_value["index"]
-		text_value_values 	= text_value["value"]
-
-		input_value 		= nodes["inputValue"]
-		input_value_index 	= input_value["index"]
-		input_value_values 	= input_value["value"]
-
-		input_checked 		= nodes["inputChecked"]
-		layout 				= document["layout"]
-		layout_node_index 	= layout["nodeIndex"]
-		bounds 				= layout["bounds"]
-
-		cursor = 0
-		html_elements_text = []
-
-		child_nodes = {}
-		elements_in_view_port = []
-
-		anchor_ancestry = {"-1": (False, None)}
-		button_ancestry = {"-1": (False, None)}
-
-		def convert_name(node_name, has_click_handler):
-			if node_name == "a":
-				return "link"
-			if node_name == "input":
-				return "input"
-			if node_name == "img":
-				return "img"
-			if (
-				node_name == "button" or has_click_handler
-			):  # found pages that needed this quirk
-				return "button"
-			else:
-				return "text"
-
-		def find_attributes(attributes, keys):
-			values = {}
-
-			for [key_index, value_index] in zip(*(iter(attributes),) * 2):
-				if value_index < 0:
-					continue
-				key = strings[key_index]
-				value = strings[value_index]
-
-				if key in keys:
-					values[key] = value
-					keys.remove(key)
-
-					if not keys:
-						return values
-
-			return values
-
-		def add_to_hash_tree(hash_tree, tag, node_id, node_name, parent_id):
-			parent_id_str = str(parent_id)
-			if not parent_id_str in hash_tree:
-				parent_name = strings[node_names[parent_id]].lower()
-				grand_parent_id = parent[parent_id]
-
-				add_to_hash_tree(
-					hash_tree, tag, parent_id, parent_name, grand_parent_id
-				)
-
-			is_parent_desc_anchor, anchor_id = hash_tree[parent_id_str]
-
-			# even if the anchor is nested in another anchor, we set the "root" for all descendants to be ::Self
-			if node_name == tag:
-				value = (True, node_id)
-			elif (
-				is_parent_desc_anchor
-			):  # reuse the parent's anchor_id (which could be much higher in the tree)
-				value = (True, anchor_id)
-			else:
-				value = (
-					False,
-					None,
-				)  # not a descendant of an anchor, most likely it will become text, an interactive element or discarded
-
-			hash_tree[str(node_id)] = value
-
-			return value
-
-		for index, node_name_index in enumerate(node_names):
-			node_parent = parent[index]
-			node_name = strings[node_name_index].lower()
-
-			is_ancestor_of_anchor, anchor_id = add_to_hash_tree(
-				anchor_ancestry, "a", index, node_name, node_parent
-			)
-
-			is_ancestor_of_button, button_id = add_to_hash_tree(
-				button_ancestry, "button", index, node_name, node_parent
-			)
-
-			try:
-				cursor = layout_node_index.index(
-					index
-				)  # todo replace this with proper cursoring, ignoring the fact this is O(n^2) for the moment
-			except:
-				continue
-
-			if node_name in black_listed_elements:
-				continue
-
-			[x, y, width, height] = bounds[cursor]
-			x /= device_pixel_ratio
-			y /= device_pixel_ratio
-			width /= device_pixel_ratio
-			height /= device_pixel_ratio
-
-			elem_left_bound = x
-			elem_top_bound = y
-			elem_right_bound = x + width
-			elem_lower_bound = y + height
-
-			partially_is_in_viewport = (
-				elem_left_bound < win_right_bound
-				and elem_right_bound >= win_left_bound
-				and elem_top_bound < win_lower_bound
-				and elem_lower_bound >= win_upper_bound
-			)
-
-			if not partially_is_in_viewport:
-				continue
+		tree = capture_snapshot(self.client, "agent")
+		snapshot = Snapshot(tree, metrics["device_pixel_ratio"])
+		url = snapshot.url
 
-			meta_data = []
-
-			# inefficient to grab the same set of keys for kinds of objects but its fine for now
-			element_attributes = find_attributes(
-				attributes[index], ["type", "placeholder", "aria-label", "title", "alt"]
-			)
-
-			ancestor_exception = is_ancestor_of_anchor or is_ancestor_of_button
-			ancestor_node_key = (
-				None
-				if not ancestor_exception
-				else str(anchor_id)
-				if is_ancestor_of_anchor
-				else str(button_id)
-			)
-			ancestor_node = (
-				None
-				if not ancestor_exception
-				else child_nodes.setdefault(str(ancestor_node_key), [])
-			)
-
-			if node_name == "#text" and ancestor_exception:
-				text = strings[node_value[index]]
-				if text == "|" or text == "•":
-					continue
-				ancestor_node.append({
-					"type": "type", "value": text
-				})
-			else:
-				if (
-					node_name == "input" and element_attributes.get("type") == "submit"
-				) or node_name == "button":
-					node_name = "button"
-					element_attributes.pop(
-						"type", None
-					)  # prevent [button ... (button)..]
-				
-				for key in element_attributes:
-					if ancestor_exception:
-						ancestor_node.append({
-							"type": "attribute",
-							"key":  key,
-							"value": element_attributes[key]
-						})
-					else:
-						meta_data.append(element_attributes[key])
-
-			element_node_value = None
-
-			if node_value[index] >= 0:
-				element_node_value = strings[node_value[index]]
-				if element_node_value == "|": #commonly used as a seperator, does not add much context - lets save ourselves some token space
-					continue
-			elif (
-				node_name == "input"
-				and index in input_value_index
-				and element_node_value is None
-			):
-				node_input_text_index = input_value_index.index(index)
-				text_index = input_value_values[node_input_text_index]
-				if node_input_text_index >= 0 and text_index >= 0:
-					element_node_value = strings[text_index]
-
-			# remove redudant elements
-			if ancestor_exception and (node_name != "a" and node_name != "button"):
-				continue
-
-			elements_in_view_port.append(
-				{
-					"node_index": str(index),
-					"backend_node_id": backend_node_id[index],
-					"node_name": node_name,
-					"node_value": element_node_value,
-					"node_meta": meta_data,
-					"is_clickable": index in is_clickable,
-					"origin_x": int(x),
-					"origin_y": int(y),
-					"center_x": int(x + (width / 2)),
-					"center_y": int(y + (height / 2)),
-				}
-			)
-
-		# lets filter further to remove anything that does not hold any text nor has click handlers + merge text from leaf#text nodes with the parent
-		elements_of_interest= []
-		elements_of_interest.append("<url>"+url+"</url>")
+		mask = snapshot.cull(viewport, metrics) & ~snapshot.name_mask(black_listed_elements)
 		self.url = url
-		id_counter 			= 0
-
-		for element in elements_in_view_port:
-			node_index = element.get("node_index")
-			node_name = element.get("node_name")
-			node_value = element.get("node_value")
-			is_clickable = element.get("is_clickable")
-			origin_x = element.get("origin_x")
-			origin_y = element.get("origin_y")
-			center_x = element.get("center_x")
-			center_y = element.get("center_y")
-			meta_data = element.get("node_meta")
-
-			inner_text = f"{node_value} " if node_value else ""
-			meta = ""
-			
-			if node_index in child_nodes:
-				for child in child_nodes.get(node_index):
-					entry_type = child.get('type')
-					entry_value= child.get('value')
-
-					if entry_type == "attribute":
-						entry_key = child.get('key')
-						meta_data.append(f'{entry_key}="{entry_value}"')
-					else:
-						inner_text += f"{entry_value} "
-
-			if meta_data:
-				meta_string = " ".join(meta_data)
-				meta = f" {meta_string}"
-
-			if inner_text != "":
-				inner_text = f"{inner_text.strip()}"
-
-			converted_node_name = convert_name(node_name, is_clickable)
-
-			# not very elegant, more like a placeholder
-			if (
-				(converted_node_name != "button" or meta == "")
-				and converted_node_name != "link"
-				and converted_node_name != "input"
-				and converted_node_name != "img"
-				and converted_node_name != "textarea"
-			) and inner_text.strip() == "":
-				continue
-
-			page_element_buffer[id_counter] = element
-
-			if inner_text != "": 
-				elements_of_interest.append(
-					f"""<{converted_node_name} id={id_counter}{meta}>{inner_text}</{converted_node_name}>"""
-				)
-			else:
-				elements_of_interest.append(
-					f"""<{converted_node_name} id={id_counter}{meta}/>"""
-				)
-			id_counter += 1
-
-		print("Parsing time: {:0.2f} seconds".format(time.time() - start))
-		return elements_of_interest
+		first = None
+		if main_content:
+			first, nav = content_masks(snapshot, mask, nav_links, controls=True)
+			mask = first | nav
+		yield "<url>"+url+"</url>"
+		if incremental:
+			yield from self.incremental.serialize(snapshot, mask, page_element_buffer, first)
+		elif first is None:
+			yield from iter_serialized(snapshot, mask, page_element_buffer)
+		else:
+			element_ids = ElementIds()
+			yield from iter_serialized(snapshot, first, page_element_buffer, element_ids)
+			yield from iter_serialized(snapshot, nav, page_element_buffer, element_ids)
 
 def natbot(natbot_prompt):
 	_crawler = Crawler()
@@ -532,18 +278,26 @@ def natbot(natbot_prompt):
 			"(h) to view commands again\n(r/enter) to run suggested command\n(o) change objective"
 		)
 
-	def get_gpt_command(objective, url, previous_command, browser_content):
+	# times each exact prompt was asked this run: a step that changed nothing (a CLICK that doesn't navigate)
+	# repeats the previous prompt, and the cached command for it would then come back forever
+	prompt_attempts = {}
+
+	def get_gpt_command(objective, url, previous_command, browser_lines):
 		prompt = prompt_template
 		prompt = prompt.replace("$objective", objective)
 		prompt = prompt.replace("$url", url[:100])
 		prompt = prompt.replace("$previous_command", previous_command)
-		prompt = prompt.replace("$browser_content", browser_content[:4500])
+		# as many serialized lines as the context window leaves room for, pulled lazily
+		budget = token_counter.prompt_budget(prompt.replace("$browser_content", ""), 50)
+		prompt = prompt.replace("$browser_content", take_within_tokens(browser_lines, budget, token_counter))
 		# print('A new tab should have opened')
 		# _crawler.new_tab()
 		# placeholder while trying to get chatgpt to give a response
 		# response = _crawler.ask('who is King Louis 7th?')
 		# print('Response here: ', response)
-		response = openai.Completion.create(model="text-davinci-003", prompt=prompt, temperature=0.5, best_of=1, n=1, max_tokens=50)
+		attempt = prompt_attempts.get(prompt, 0)
+		prompt_attempts[prompt] = attempt + 1
+		response = create_completion(attempt, model="text-davinci-003", prompt=prompt, temperature=0.5, best_of=1, n=1, max_tokens=50)
 		# bot = ChatGPT()
 		# response = bot.ask('is New York state richer than California?')
 		# print(response)
@@ -593,9 +347,9 @@ def natbot(natbot_prompt):
 	try:
     # Change this to exit when ANSWER is the gpt_cmd
 		while True:
-			browser_content = "\n".join(_crawler.crawl())
+			# get_gpt_command stops pulling lines once the token budget is filled
 			prev_cmd = gpt_cmd
-			gpt_cmd = get_gpt_command(objective, _crawler.page.url, prev_cmd, browser_content)
+			gpt_cmd = get_gpt_command(objective, _crawler.page.url, prev_cmd, _crawler.iter_crawl())
 			gpt_cmd = gpt_cmd.strip()
 
 			# if not quiet:
@@ -753,29 +507,39 @@ class Crawler2:
       self.client = self.page.context.new_cdp_session(self.page)
       self.page_element_buffer = {}
 
-  def crawl(self, url):
+  def crawl(self, url, viewport=Viewport.full_page(), backend="dom", main_content=True, nav_links=0):
+      start = time.time()
+      elements_of_interest = list(self.iter_crawl(url, viewport, backend, main_content, nav_links))
+      print("Parsing time: {:0.2f} seconds".format(time.time() - start))
+      return elements_of_interest
+
+  def capture(self, url):
+      # navigation + snapshot only, for callers that parse elsewhere (question_bot_batch)
+      Crawler2.qa_go_to_page(self, url)
+      metrics = page_metrics(self.page)
+      tree = capture_snapshot(self.client, "qa")
+      return tree, metrics
+
+  def iter_crawl(self, url, viewport=Viewport.full_page(), backend="dom", main_content=True, nav_links=0):
+      # generator version of crawl(): yields each element as soon as it is serialized
+      # main_content limits the dom backend to the detected main region, plus nav_links links from the rest
+      # backend "ax" reads the accessibility tree instead of a DOMSnapshot (whole page, no culling)
       Crawler2.qa_go_to_page(self, url)
       page = self.page
       client = page.context.new_cdp_session(self.page)
       page_element_buffer = {}
-      start = time.time()
+      self.page_element_buffer = page_element_buffer
+
+      if backend == "ax":
+        self.snapshot = None
+        self.mask = None
+        yield from iter_ax_serialized(capture_ax_tree(client), page_element_buffer)
+        return
 
       page_state_as_text = []
 
-      device_pixel_ratio = page.evaluate("window.devicePixelRatio")
-      if platform == "darwin" and device_pixel_ratio == 1:  # lies
-        device_pixel_ratio = 2
-
-      win_scroll_x 		= page.evaluate("window.scrollX")
-      win_scroll_y 		= page.evaluate("window.scrollY")
-      win_upper_bound 	= page.evaluate("window.pageYOffset")
-      win_left_bound 		= page.evaluate("window.pageXOffset") 
-      win_width 			= page.evaluate("window.screen.width")
-      win_height 			= page.evaluate("window.screen.height")
-      win_right_bound 	= win_left_bound + win_width
-      win_lower_bound 	= win_upper_bound + win_height
-    #   document_offset_height = page.evaluate("document.body.offsetHeight")
-      document_scroll_height = page.evaluate("document.body.scrollHeight")
+      # one round trip for all window/document metrics instead of one evaluate per value
+      metrics = page_metrics(page)
 
   #		percentage_progress_start = (win_upper_bound / document_scroll_height) * 100
   #		percentage_progress_end = (
@@ -794,348 +558,109 @@ class Crawler2:
         }
       )
 
-      tree = client.send(
-        "DOMSnapshot.captureSnapshot",
-        {"computedStyles": [], "includeDOMRects": True, "includePaintOrder": True},
-      )
-      strings	 	= tree["strings"]
-      document 	= tree["documents"][0]
-      nodes 		= document["nodes"]
-      backend_node_id = nodes["backendNodeId"]
-      attributes 	= nodes["attributes"]
-      node_value 	= nodes["nodeValue"]
-      parent 		= nodes["parentIndex"]
-      node_types 	= nodes["nodeType"]
-      node_names 	= nodes["nodeName"]
-      is_clickable = set(nodes["isClickable"]["index"])
-
-      text_value 			= nodes["textValue"]
-      text_value_index 	= text_value["index"]
-      text_value_values 	= text_value["value"]
-
-      input_value 		= nodes["inputValue"]
-      input_value_index 	= input_value["index"]
-      input_value_values 	= input_value["value"]
-
-      input_checked 		= nodes["inputChecked"]
-      layout 				= document["layout"]
-      layout_node_index 	= layout["nodeIndex"]
-      bounds 				= layout["bounds"]
-
-      cursor = 0
-      html_elements_text = []
-
-      child_nodes = {}
-      elements_in_view_port = []
-
-      anchor_ancestry = {"-1": (False, None)}
-      button_ancestry = {"-1": (False, None)}
-
-      def convert_name(node_name, has_click_handler):
-        if node_name == "a":
-          return "link"
-        if node_name == "input":
-          return "input"
-        if node_name == "img":
-          return "img"
-        if (
-          node_name == "button" or has_click_handler
-        ):  # found pages that needed this quirk
-          return "button"
-        else:
-          return "text"
-
-      def find_attributes(attributes, keys):
-        values = {}
-
-        for [key_index, value_index] in zip(*(iter(attributes),) * 2):
-          if value_index < 0:
-            continue
-          key = strings[key_index]
-          value = strings[value_index]
-
-          if key in keys:
-            values[key] = value
-            keys.remove(key)
-
-            if not keys:
-              return values
-
-        return values
-
-      def add_to_hash_tree(hash_tree, tag, node_id, node_name, parent_id):
-        parent_id_str = str(parent_id)
-        if not parent_id_str in hash_tree:
-          parent_name = strings[node_names[parent_id]].lower()
-          grand_parent_id = parent[parent_id]
-
-          add_to_hash_tree(
-            hash_tree, tag, parent_id, parent_name, grand_parent_id
-          )
-
-        is_parent_desc_anchor, anchor_id = hash_tree[parent_id_str]
-
-        # even if the anchor is nested in another anchor, we set the "root" for all descendants to be ::Self
-        if node_name == tag:
-          value = (True, node_id)
-        elif (
-          is_parent_desc_anchor
-        ):  # reuse the parent's anchor_id (which could be much higher in the tree)
-          value = (True, anchor_id)
-        else:
-          value = (
-            False,
-            None,
-          )  # not a descendant of an anchor, most likely it will become text, an interactive element or discarded
-
-        hash_tree[str(node_id)] = value
-
-        return value
-
-      for index, node_name_index in enumerate(node_names):
-        node_parent = parent[index]
-        node_name = strings[node_name_index].lower()
-
-        is_ancestor_of_anchor, anchor_id = add_to_hash_tree(
-          anchor_ancestry, "a", index, node_name, node_parent
-        )
-
-        is_ancestor_of_button, button_id = add_to_hash_tree(
-          button_ancestry, "button", index, node_name, node_parent
-        )
-
-        try:
-          cursor = layout_node_index.index(
-            index
-          )  # todo replace this with proper cursoring, ignoring the fact this is O(n^2) for the moment
-        except:
-          continue
-
-        if node_name in black_listed_elements:
-          continue
+      tree = capture_snapshot(client, "qa")
+      snapshot = Snapshot(tree, metrics["device_pixel_ratio"])
+
+      # Q&A reads the whole page by default, so nothing is culled unless asked for
+      mask = snapshot.cull(viewport, metrics) & ~snapshot.name_mask(black_listed_elements)
+      # kept for extract_records, which reads the same parse
+      self.snapshot = snapshot
+      self.mask = mask
+      if not main_content:
+        yield from iter_serialized(snapshot, mask, page_element_buffer)
+        return
+      main, nav = content_masks(snapshot, mask, nav_links)
+      element_ids = ElementIds()
+      yield from iter_serialized(snapshot, main, page_element_buffer, element_ids)
+      yield from iter_serialized(snapshot, nav, page_element_buffer, element_ids)
+
+def qa_completion(prompt):
+  response = create_completion(model="text-davinci-003", prompt=prompt, top_p=1, temperature=0.3, best_of=1, n=1, max_tokens=250)
+  return response.choices[0].text
+
+def qa_get_gpt_command(question, lines, groups=None, overlap=0, max_in_flight=4, top_k=None):
+  # pages over the token budget left by the prompt and max_tokens are asked about in chunks of whole lines
+  # (chunker.chunk_lines, keeping the lines of one row together when groups are given), with up to
+  # max_in_flight requests at once; the answers come back in chunk order
+  # with top_k (single-fact questions), only the best chunks by BM25 are asked about, unless the ranking
+  # isn't confident (ranking.select_chunks)
+  prompt = question_prompt_template
+  prompt = prompt.replace("$question", question)
+  budget = token_counter.prompt_budget(prompt.replace("$browser_content", ""), 250)
+  content_tokens = sum(token_counter.count_line(line) for line in lines) + len(lines) - 1
+  if content_tokens > budget:
+    chunks = chunk_lines(lines, budget, groups, overlap, token_counter)
+    if top_k is not None:
+      selected = select_chunks(question, chunks, top_k)
+      print("Asking about {} of {} chunks".format(len(selected), len(chunks)))
+      chunks = [chunks[index] for index in selected]
+    prompts = [prompt.replace("$browser_content", chunk) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+      return list(executor.map(qa_completion, prompts))
+  prompt = prompt.replace("$browser_content", "\n".join(lines))
+  return qa_completion(prompt)
 
-        # [x, y, width, height] = bounds[cursor]
-        # x /= device_pixel_ratio
-        # y /= device_pixel_ratio
-        # width /= device_pixel_ratio
-        # height /= device_pixel_ratio
-
-        # elem_left_bound = x
-        # elem_top_bound = y
-        # elem_right_bound = x + width
-        # elem_lower_bound = y + height
-
-        # partially_is_in_viewport = (
-        # 	elem_left_bound < win_right_bound
-        # 	and elem_right_bound >= win_left_bound
-        # 	and elem_top_bound < win_lower_bound
-        # 	and elem_lower_bound >= win_upper_bound
-        # )
-
-        # if not partially_is_in_viewport:
-        # 	continue
-
-        meta_data = []
-
-        # inefficient to grab the same set of keys for kinds of objects but its fine for now
-        element_attributes = find_attributes(
-          attributes[index], ["type", "placeholder", "aria-label", "title", "alt"]
-        )
-
-        ancestor_exception = is_ancestor_of_anchor or is_ancestor_of_button
-        ancestor_node_key = (
-          None
-          if not ancestor_exception
-          else str(anchor_id)
-          if is_ancestor_of_anchor
-          else str(button_id)
-        )
-        ancestor_node = (
-          None
-          if not ancestor_exception
-          else child_nodes.setdefault(str(ancestor_node_key), [])
-        )
-
-        if node_name == "#text" and ancestor_exception:
-          text = strings[node_value[index]]
-          if text == "|" or text == "•":
-            continue
-          ancestor_node.append({
-            "type": "type", "value": text
-          })
-        else:
-          if (
-            node_name == "input" and element_attributes.get("type") == "submit"
-          ) or node_name == "button":
-            node_name = "button"
-            element_attributes.pop(
-              "type", None
-            )  # prevent [button ... (button)..]
-          
-          for key in element_attributes:
-            if ancestor_exception:
-              ancestor_node.append({
-                "type": "attribute",
-                "key":  key,
-                "value": element_attributes[key]
-              })
-            else:
-              meta_data.append(element_attributes[key])
-
-        element_node_value = None
-
-        if node_value[index] >= 0:
-          element_node_value = strings[node_value[index]]
-          if element_node_value == "|": #commonly used as a seperator, does not add much context - lets save ourselves some token space
-            continue
-        elif (
-          node_name == "input"
-          and index in input_value_index
-          and element_node_value is None
-        ):
-          node_input_text_index = input_value_index.index(index)
-          text_index = input_value_values[node_input_text_index]
-          if node_input_text_index >= 0 and text_index >= 0:
-            element_node_value = strings[text_index]
-
-        # remove redudant elements
-        if ancestor_exception and (node_name != "a" and node_name != "button"):
-          continue
-
-        elements_in_view_port.append(
-          {
-            "node_index": str(index),
-            "backend_node_id": backend_node_id[index],
-            "node_name": node_name,
-            "node_value": element_node_value,
-            "node_meta": meta_data,
-            "is_clickable": index in is_clickable,
-            # "origin_x": int(x),
-            # "origin_y": int(y),
-            # "center_x": int(x + (width / 2)),
-            # "center_y": int(y + (height / 2)),
-          }
-        )
-
-      # lets filter further to remove anything that does not hold any text nor has click handlers + merge text from leaf#text nodes with the parent
-      elements_of_interest= []
-      id_counter 			= 0
-
-      for element in elements_in_view_port:
-        node_index = element.get("node_index")
-        node_name = element.get("node_name")
-        node_value = element.get("node_value")
-        is_clickable = element.get("is_clickable")
-        origin_x = element.get("origin_x")
-        origin_y = element.get("origin_y")
-        center_x = element.get("center_x")
-        center_y = element.get("center_y")
-        meta_data = element.get("node_meta")
-
-        inner_text = f"{node_value} " if node_value else ""
-        meta = ""
-        
-        if node_index in child_nodes:
-          for child in child_nodes.get(node_index):
-            entry_type = child.get('type')
-            entry_value= child.get('value')
-
-            if entry_type == "attribute":
-              entry_key = child.get('key')
-              meta_data.append(f'{entry_key}="{entry_value}"')
-            else:
-              inner_text += f"{entry_value} "
-
-        if meta_data:
-          meta_string = " ".join(meta_data)
-          meta = f" {meta_string}"
-
-        if inner_text != "":
-          inner_text = f"{inner_text.strip()}"
-
-        converted_node_name = convert_name(node_name, is_clickable)
-
-        # not very elegant, more like a placeholder
-        if (
-          (converted_node_name != "button" or meta == "")
-          and converted_node_name != "link"
-          and converted_node_name != "input"
-          and converted_node_name != "img"
-          and converted_node_name != "textarea"
-        ) and inner_text.strip() == "":
-          continue
+"""
+  Answer format: Provide each detail in a separate line in the order: name, title, email, phone number. Space between each detail.
+  
+  If a detail like email address isn't shown in browser content, then put unknown in the output.
+"""
 
-        page_element_buffer[id_counter] = element
+qa_question = """
+	Use the CURRENT BROWSER CONTENT to return the name and title, separated by commas, for all guidance counsellors listed in the CURRENT BROWSER CONTENT.
 
-        if inner_text != "": 
-          elements_of_interest.append(
-            f"""<{converted_node_name} id={id_counter}{meta}>{inner_text}</{converted_node_name}>"""
-          )
-        else:
-          elements_of_interest.append(
-            f"""<{converted_node_name} id={id_counter}{meta}/>"""
-          )
-        id_counter += 1
+  Each guidance counsellor should be on a separate line in the output.
 
-      print("Parsing time: {:0.2f} seconds".format(time.time() - start))
-      return elements_of_interest
+  If the answer is a null type answer for the CURRENT BROWSER CONTENT, then put "UNKNOWN" as the output for that section.
+"""
 
-def question_bot(url):
+# named Q&A questions, picked by id in question_bot / question_bot_batch
+qa_questions = {
+  "guidance_counsellors": qa_question,
+}
+
+# per question id, the job title that lets a rule-extracted directory row answer it without asking the model;
+# a question without an entry always goes to the model
+qa_record_filters = {
+  "guidance_counsellors": re.compile(r"\bcounsell?or", re.IGNORECASE),
+}
+
+def records_answer(question_id, records, lines):
+  # "name, title" lines like the model's answers, or None to fall back to the LLM: when the question has no
+  # record filter, no extracted row carries the title (in a field after the first, the name), or the page
+  # mentions the title in more places than the matching rows hold (the extraction missed part of the directory)
+  record_filter = qa_record_filters.get(question_id)
+  if record_filter is None:
+    return None
+  matching = [record for record in records if any(record_filter.search(field) for field in record["fields"][1:])]
+  covered = sum(1 for record in matching for field in record["fields"][1:] if record_filter.search(field))
+  mentions = sum(1 for line in lines if record_filter.search(line))
+  if len(matching) == 0 or mentions > covered:
+    return None
+  return "\n".join(record_summary(record) for record in matching)
+
+def question_bot(url, backend="dom", question_id="guidance_counsellors", top_k=None):
   _crawler2 = Crawler2()
-
-  def qa_get_gpt_command(question, browser_content):
-    prompt = question_prompt_template
-    prompt = prompt.replace("$question", question)
-    full_response = []
-    if len(browser_content) > 5500:
-      for i in range(0, len(browser_content), 5500):
-        prompt = question_prompt_template
-        prompt = prompt.replace("$question", question)
-        # print('browser section', i, ': ', browser_content[i:i+5500])
-        prompt = prompt.replace("$browser_content", browser_content[i:i+5500])
-        # print('prompt section', i, ': ', prompt)
-        response = openai.Completion.create(model="text-davinci-003", prompt=prompt, top_p=1, temperature=0.3, best_of=1, n=1, max_tokens=250)
-        # print("loop", i, response.choices[0].text)
-        full_response.append(response.choices[0].text)
-      # _crawler2.client.detach()
-      # for context in _crawler2.browser.contexts:
-      #   context.close()
-      # _crawler2.browser.close()
-      # _crawler2.playwright.stop()
-      return full_response
-    prompt = prompt.replace("$browser_content", browser_content)
-    response = openai.Completion.create(model="text-davinci-003", prompt=prompt, top_p=1, temperature=0.3, best_of=1, n=1, max_tokens=250)
-    # _crawler2.client.detach()
-    # for context in _crawler2.browser.contexts:
-    #   context.close()
-    # _crawler2.browser.close()
-    # _crawler2.playwright.stop()
-    return response.choices[0].text
-
-  """
-    Answer format: Provide each detail in a separate line in the order: name, title, email, phone number. Space between each detail.
-    
-    If a detail like email address isn't shown in browser content, then put unknown in the output.
-  """
-
-  question = """
-  	Use the CURRENT BROWSER CONTENT to return the name and title, separated by commas, for all guidance counsellors listed in the CURRENT BROWSER CONTENT.
-
-    Each guidance counsellor should be on a separate line in the output.
-
-    If the answer is a null type answer for the CURRENT BROWSER CONTENT, then put "UNKNOWN" as the output for that section.
-	"""
+  question = qa_questions[question_id]
 #   print("\nWelcome to Q&A bot! What is your question?")
 #   i = input()
 #   if len(i) > 0:
 #     question = i
-  browser_content = "\n".join(_crawler2.crawl(url=url))
+  lines = _crawler2.crawl(url=url, backend=backend)
+  answer = None
+  groups = None
+  if _crawler2.snapshot is not None:
+    rows = record_rows(_crawler2.snapshot, _crawler2.mask)
+    answer = records_answer(question_id, extract_records(_crawler2.snapshot, _crawler2.mask, rows=rows), lines)
+    groups = line_groups(_crawler2.snapshot, rows, _crawler2.page_element_buffer, len(lines))
   _crawler2.client.detach()
   for context in _crawler2.browser.contexts:
     context.close()
   _crawler2.browser.close()
   _crawler2.playwright.stop()
-  return qa_get_gpt_command(question, browser_content)
+  if answer is not None:
+    return answer
+  return qa_get_gpt_command(question, lines, groups, top_k=top_k)
 
 #   try:
 #     while True:
@@ -1152,6 +677,35 @@ def question_bot(url):
 #     print("\n[!] Ctrl+C detected, exiting gracefully.")
 #     exit(0)
 
+def question_bot_batch(urls, question_id="guidance_counsellors", max_workers=None, max_pending=4, top_k=None):
+  # question_bot over many pages: this thread only navigates and captures, snapshots are parsed in a
+  # process pool meanwhile (at most max_pending waiting), answers are returned in the order of urls;
+  # top_k is passed on to qa_get_gpt_command for the pages the extracted rows don't answer
+  question = qa_questions[question_id]
+  _crawler2 = Crawler2()
+  with ParsePool(max_workers=max_workers, max_pending=max_pending) as pool:
+    start = time.time()
+    pages = [pool.submit(*_crawler2.capture(url)) for url in urls]
+    _crawler2.client.detach()
+    for context in _crawler2.browser.contexts:
+      context.close()
+    _crawler2.browser.close()
+    _crawler2.playwright.stop()
+    parsed = [page.result() for page in pages]
+    print("Capture + parsing time for {} pages: {:0.2f} seconds".format(len(urls), time.time() - start))
+
+  responses = []
+  extracted = 0
+  for lines, records, groups in parsed:
+    answer = records_answer(question_id, records, lines)
+    if answer is None:
+      answer = qa_get_gpt_command(question, lines, groups, top_k=top_k)
+    else:
+      extracted += 1
+    responses.append(answer)
+  print("Answered {} of {} pages from extracted rows".format(extracted, len(parsed)))
+  return responses
+
 def davinci(prompt):
 	prompt_template = """
 		Your job is to be a Q&A bot that returns the answer as a python string that is comma delimited. Your answer should be as concise as possible.
@@ -1171,7 +725,7 @@ def davinci(prompt):
 		Question: {question}
 	"""
 	prompt_template = prompt_template.replace("{question}", prompt)
-	response = openai.Completion.create(model="text-davinci-003", prompt=prompt_template, temperature=0.5, best_of=5, n=1, max_tokens=250)
+	response = create_completion(model="text-davinci-003", prompt=prompt_template, temperature=0.5, best_of=5, n=1, max_tokens=250)
 	res = response.choices[0].text.split(",")
 	res = [x.strip() for x in res]
 	return res
@@ -1211,11 +765,8 @@ def main():
 # #     time.sleep(10)
 #   print('our url: ', urls)
 
-  question_responses = []
-
   urls = ['https://www.amityregion5.org/directory', 'https://bmhs.norwalkps.org/381082_4', 'https://www.bridgeportedu.net/Page/14081', 'https://bullard-havens.cttech.org/about/staff-directory/']
-  for url in urls:
-     question_responses.append(question_bot(url))
+  question_responses = question_bot_batch(urls)
   print(question_responses)
 
   clean_question_responses = []
@@ -1233,6 +784,7 @@ def main():
         # clean_question_responses.append(section.split(','))
         clean_question_responses.append(re.split(r'[,\n]' , section))
   print(clean_question_responses)
+  print("LLM cache: {hits} hits, {misses} misses, {evictions} evicted, {entries} entries".format(**default_cache().stats()))
 
   # temp_url = 'https://www.brookfield.k12.ct.us/brookfield-high-school/pages/brookfield-high-school-staff-directory'
   # question_bot(temp_url)
@@ -0,0 +1,99 @@
+#
+# content.py
+#
+# Main-content detection: picks the subtree holding the page's actual content
+# (staff list, article, results) so headers, mega-menus and footers don't crowd
+# it out of the prompt.
+#
+
+import numpy as np
+
+# landmarks whose text never counts as content
+landmark_tags = set(["nav", "header", "footer", "aside"])
+landmark_roles = set(["navigation", "banner", "contentinfo", "complementary", "search"])
+
+# form controls kept in the navigation summary whatever region they are in (search boxes, submit, cookie Accept)
+control_tags = set(["input", "button", "select", "textarea"])
+
+
+def main_region(snapshot, dominance=0.5, slack=0.2, min_chars=200):
+	"""
+	Node index of the main-content region, or None when the page has no clear one.
+	Every subtree is scored by its visible non-link text outside landmarks (text density with links and
+	navigation discounted). Starting at <body>, the walk descends while one child holds at least `dominance`
+	of the score, then widens back up that path one parent at a time while the parent either adds real content
+	(at least `min_chars` of score, e.g. a sibling section of the directory) or little text at all (its total
+	within 1 / (1 - `slack`) of the region's, 25% more at the default), so headings and sibling sections stay
+	with the rows but a large menu next to them doesn't. An explicit <main> / role=main with real content wins outright.
+	"""
+	names = snapshot.names
+	visible = snapshot.has_layout & snapshot.visible()
+
+	text_rows = np.flatnonzero((names == "#text") & visible & (snapshot.node_value >= 0))
+	text_length = np.zeros(snapshot.size)
+	text_length[text_rows] = [len(snapshot.strings[value].strip()) for value in snapshot.node_value[text_rows].tolist()]
+
+	roles = {node: attributes["role"] for node, attributes in snapshot.attribute_index(["role"]).items()}
+	landmark = snapshot.name_mask(landmark_tags)
+	is_main = snapshot.name_mask(["main"])
+	for node, role in roles.items():
+		landmark[node] |= role in landmark_roles
+		is_main[node] |= role == "main"
+
+	discounted = snapshot.inherited(landmark) | snapshot.inherited(snapshot.name_mask(["a"]))
+	score = snapshot.subtree_sums(np.where(discounted, 0, text_length))
+	total = snapshot.subtree_sums(text_length)
+
+	mains = np.flatnonzero(is_main & visible)
+	if len(mains):
+		best = mains[np.argmax(score[mains])]
+		if score[best] >= min_chars:
+			return int(best)
+
+	bodies = np.flatnonzero(snapshot.name_mask(["body"]))
+	root = int(bodies[0]) if len(bodies) else 0
+	path = [root]
+	while True:
+		children = np.flatnonzero(snapshot.parent == path[-1])
+		if len(children) == 0:
+			break
+		best = int(children[np.argmax(score[children])])
+		if score[best] < dominance * score[path[-1]] or score[best] < min_chars:
+			break
+		path.append(best)
+
+	region = path[-1]
+	for node in reversed(path[:-1]):
+		if score[node] - score[region] < min_chars and total[region] < (1 - slack) * total[node]:
+			break
+		region = node
+	if region == root or score[region] < min_chars:
+		return None
+	return region
+
+
+def content_masks(snapshot, mask, nav_links=0, controls=False):
+	"""
+	(main, nav) masks: the part of `mask` inside main_region(), and a condensed summary of the rest: the first
+	`nav_links` links of `mask` outside it and, with `controls`, every form control and other clickable element
+	outside it (what an agent types into or presses), all with their text.
+	When no region is found, main is `mask` itself and nav is empty.
+	"""
+	region = main_region(snapshot)
+	if region is None:
+		return mask, np.zeros(snapshot.size, dtype=bool)
+
+	in_region = np.zeros(snapshot.size, dtype=bool)
+	in_region[region] = True
+	in_region = snapshot.inherited(in_region)
+
+	outside = mask & ~in_region
+	is_anchor = snapshot.name_mask(["a"])
+	anchors = np.flatnonzero(outside & is_anchor)[:nav_links]
+	nav = np.isin(snapshot.owner_nodes(), anchors)
+	if controls:
+		# clickable anchors stay under the nav_links cap; other clickables don't own their text, so it comes along
+		clickable = snapshot.is_clickable & ~is_anchor
+		clickable_text = (snapshot.parent >= 0) & clickable[snapshot.parent] & (snapshot.names == "#text")
+		nav |= snapshot.inherited(snapshot.name_mask(control_tags)) | clickable | clickable_text
+	return mask & in_region, outside & nav
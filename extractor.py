@@ -0,0 +1,130 @@
+#
+# extractor.py
+#
+# Rule-based extraction of directory rows (tables, repeated cards) straight from a
+# Snapshot, so tabular pages don't need a model call. Callers fall back to the LLM
+# when nothing record-like is found.
+#
+
+import re
+
+import numpy as np
+
+email_pattern = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+phone_pattern = re.compile(r"\(?\d{3}\)?[\s.-]*\d{3}[\s.-]*\d{4}")
+
+# text nodes that are only separators
+separators = set(["", "|", "•", "-", ","])
+
+
+def record_rows(snapshot, mask, min_rows=3, min_fields=2, max_fields=12):
+	"""
+	Finds groups of at least `min_rows` sibling subtrees with the same shape (tag, class, child tags) whose
+	rows mostly carry between `min_fields` and `max_fields` texts, and returns (row node, [visible texts])
+	for every row of the selected groups, in document order. The subtrees of these rows never overlap.
+	Nested or overlapping groups are resolved in favor of the one with the most record-sized rows, so a
+	list of department sections loses to the staff rows inside them.
+	"""
+	names = snapshot.names
+	parent = snapshot.parent
+	strings = snapshot.strings
+	subtree_end = np.asarray(snapshot.subtree_end(), dtype=np.int64)
+	nodes = np.arange(snapshot.size)
+
+	# visible, non-separator text nodes in document order, with their text
+	is_text = (names == "#text") & mask & (snapshot.node_value >= 0)
+	text_rows = np.flatnonzero(is_text)
+	texts = [strings[value].strip() for value in snapshot.node_value[text_rows].tolist()]
+	keep = np.array([text not in separators for text in texts], dtype=bool)
+	text_rows = text_rows[keep]
+	texts = [text for text, kept in zip(texts, keep.tolist()) if kept]
+
+	# per node, the slice of text_rows inside its subtree, all resolved in one go
+	text_start = np.searchsorted(text_rows, nodes).tolist()
+	text_end = np.searchsorted(text_rows, subtree_end + 1).tolist()
+
+	def row_fields(index):
+		return texts[text_start[index]:text_end[index]]
+
+	# children grouped by parent, via one stable sort instead of per-node lists
+	order = np.argsort(parent, kind="stable")
+	child_counts = np.bincount(parent[parent >= 0], minlength=snapshot.size)
+	child_start = np.searchsorted(parent[order], nodes).tolist()
+	child_counts_list = child_counts.tolist()
+	order = order.tolist()
+
+	def children(index):
+		return order[child_start[index]:child_start[index] + child_counts_list[index]]
+
+	classes = snapshot.attribute_index(["class"])
+	names_list = names.tolist()
+	is_visible = mask.tolist()
+
+	def shape(index):
+		child_names = tuple(names_list[child] for child in children(index) if names_list[child] != "#text")
+		return names_list[index], classes.get(index, {}).get("class"), child_names
+
+	groups = []
+	for node in np.flatnonzero(child_counts >= min_rows).tolist():
+		by_shape = {}
+		for child in children(node):
+			if names_list[child] != "#text" and is_visible[child]:
+				by_shape.setdefault(shape(child), []).append(child)
+		for rows in by_shape.values():
+			if len(rows) < min_rows:
+				continue
+			fields = [row_fields(row) for row in rows]
+			full_rows = sum(1 for row in fields if min_fields <= len(row) <= max_fields)
+			if full_rows < min_rows or full_rows < 0.6 * len(rows):
+				continue
+			groups.append(((full_rows, sum(map(len, fields))), rows, fields))
+
+	# greedy: biggest groups first, skipping any that overlap rows already taken
+	subtree_end = subtree_end.tolist()
+	claimed = np.zeros(snapshot.size, dtype=bool)
+	selected = []
+	for _, rows, fields in sorted(groups, key=lambda group: group[0], reverse=True):
+		if any(claimed[row:subtree_end[row] + 1].any() for row in rows):
+			continue
+		for row in rows:
+			claimed[row:subtree_end[row] + 1] = True
+		selected.extend(zip(rows, fields))
+	return sorted(selected, key=lambda item: item[0])
+
+
+def extract_records(snapshot, mask, min_rows=3, min_fields=2, max_fields=12, rows=None):
+	"""
+	One record per record-sized row found by record_rows (or of `rows`, when already computed), in document
+	order: {"fields": [visible texts], "email": str or None, "phone": str or None}.
+	"""
+	if rows is None:
+		rows = record_rows(snapshot, mask, min_rows, min_fields, max_fields)
+
+	rows = [(row, fields) for row, fields in rows if min_fields <= len(fields) <= max_fields]
+	hrefs = snapshot.attribute_index(["href"])
+	href_rows = np.array(sorted(hrefs), dtype=np.int64)
+	row_nodes = np.array([row for row, _ in rows], dtype=np.int64)
+	subtree_end = np.asarray(snapshot.subtree_end(), dtype=np.int64)
+
+	# per row, the slice of href_rows inside its subtree
+	href_start = np.searchsorted(href_rows, row_nodes).tolist()
+	href_end = np.searchsorted(href_rows, subtree_end[row_nodes] + 1).tolist()
+	href_nodes = href_rows.tolist()
+
+	records = []
+	for (row, fields), start, end in zip(rows, href_start, href_end):
+		text = " ".join(fields + [hrefs[node]["href"] for node in href_nodes[start:end]])
+		email = email_pattern.search(text)
+		phone = phone_pattern.search(text)
+		records.append({
+			"fields": fields,
+			"email": email.group(0) if email else None,
+			"phone": phone.group(0) if phone else None,
+		})
+	return records
+
+
+def record_summary(record, field_count=2):
+	"""The first `field_count` fields that aren't an email or phone number, joined like the model's "name, title" answers."""
+	fields = [field for field in record["fields"] if not email_pattern.fullmatch(field) and not phone_pattern.fullmatch(field)]
+	return ", ".join(fields[:field_count])
@@ -0,0 +1,142 @@
+#
+# llm_cache.py
+#
+# On-disk cache in front of openai.Completion.create, keyed by a sha256 of the model,
+# parameters and prompt, so nightly re-runs over the same pages don't pay for
+# answers we already have. Least recently used entries are evicted past a size limit.
+#
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import openai
+from openai.util import convert_to_openai_object
+
+
+class CompletionCache:
+	"""
+	sqlite-backed response cache. Entries older than `ttl` seconds (None: never) count as misses,
+	and the least recently used ones are dropped once the stored responses exceed `max_bytes`.
+	Safe to share between threads; the API call itself runs outside the lock.
+	"""
+
+	def __init__(self, path=".llm_cache.sqlite", max_bytes=256 * 1024 * 1024, ttl=None):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		with self.connection:
+			self.connection.execute(
+				"CREATE TABLE IF NOT EXISTS responses ("
+				"key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+			)
+			self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+	@staticmethod
+	def key(params):
+		"""sha256 over the request parameters (model, sampling settings, prompt), independent of their order."""
+		encoded = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+		return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+	def get(self, key):
+		"""The cached response as an OpenAIObject, or None when missing or expired."""
+		now = time.time()
+		with self.lock:
+			row = self.connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+			if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+				with self.connection:
+					self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+				row = None
+			if row is None:
+				self.misses += 1
+				return None
+			with self.connection:
+				self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+			self.hits += 1
+		return convert_to_openai_object(json.loads(row[0]))
+
+	def put(self, key, response):
+		encoded = json.dumps(response.to_dict_recursive(), separators=(",", ":"))
+		now = time.time()
+		with self.lock, self.connection:
+			self.connection.execute(
+				"INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+				(key, encoded, len(encoded), now, now),
+			)
+			self._evict()
+
+	def _evict(self):
+		# called with the lock held, inside a transaction
+		total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+		if total <= self.max_bytes:
+			return
+		stale = []
+		for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed"):
+			if total <= self.max_bytes:
+				break
+			stale.append((key,))
+			total -= size
+		self.connection.executemany("DELETE FROM responses WHERE key = ?", stale)
+		self.evictions += len(stale)
+
+	def create(self, attempt=0, **params):
+		"""
+		openai.Completion.create(**params), answered from the cache when possible. Streaming requests bypass it.
+		`attempt` > 0 marks the same request asked again in one run: it goes into the key (not to the API),
+		so a sampled prompt that is repeated gets a fresh answer instead of the one that didn't help before.
+		"""
+		if params.get("stream"):
+			return openai.Completion.create(**params)
+		key = self.key(dict(params, _attempt=attempt) if attempt else params)
+		response = self.get(key)
+		if response is None:
+			response = openai.Completion.create(**params)
+			self.put(key, response)
+		return response
+
+	def stats(self):
+		"""Counters since this cache was opened, plus what is stored on disk."""
+		with self.lock:
+			entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+		return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": entries, "bytes": size}
+
+	def clear(self):
+		with self.lock, self.connection:
+			self.connection.execute("DELETE FROM responses")
+
+	def close(self):
+		self.connection.close()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+	"""
+	The process-wide cache, opened on first use. Configured through the environment (or .env):
+	llm_cache_path, llm_cache_max_mb and llm_cache_ttl_hours.
+	"""
+	global _default_cache
+	with _default_lock:
+		if _default_cache is None:
+			ttl_hours = os.getenv("llm_cache_ttl_hours")
+			_default_cache = CompletionCache(
+				path=os.getenv("llm_cache_path", ".llm_cache.sqlite"),
+				max_bytes=int(float(os.getenv("llm_cache_max_mb", "256")) * 1024 * 1024),
+				ttl=float(ttl_hours) * 3600 if ttl_hours else None,
+			)
+		return _default_cache
+
+
+def create_completion(attempt=0, **params):
+	"""Drop-in for openai.Completion.create going through default_cache() (see CompletionCache.create for `attempt`)."""
+	return default_cache().create(attempt, **params)
@@ -0,0 +1,187 @@
+#
+# parse_pool.py
+#
+# Batch parsing of captured snapshots in worker processes, so the thread driving
+# Playwright (sync API) can navigate and capture the next page meanwhile.
+#
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from threading import BoundedSemaphore
+
+import numpy as np
+
+from content import content_masks
+from chunker import line_groups
+from extractor import extract_records, record_rows
+from snapshot import ElementIds, Snapshot, Viewport, black_listed_elements, iter_serialized
+
+
+def pack_snapshot(tree):
+	"""
+	Copies a captureSnapshot response into one shared memory block of flat arrays, with strings as a
+	utf-8 blob plus offsets and ragged attribute lists as values plus lengths.
+	Returns (shm, manifest); the manifest is small and picklable, unpack_snapshot rebuilds the tree from it.
+	"""
+	arrays = {}
+	encoded = [string.encode("utf-8") for string in tree["strings"]]
+	arrays["strings"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+	arrays["string_offsets"] = np.cumsum([0] + [len(string) for string in encoded], dtype=np.int64)
+
+	documents = []
+	for index, document in enumerate(tree["documents"]):
+		nodes = document["nodes"]
+		input_value = nodes.get("inputValue", {"index": [], "value": []})
+		content_documents = nodes.get("contentDocumentIndex", {"index": [], "value": []})
+		columns = {
+			"parentIndex": nodes["parentIndex"],
+			"nodeName": nodes["nodeName"],
+			"nodeValue": nodes["nodeValue"],
+			"backendNodeId": nodes["backendNodeId"],
+			"attributes": [item for attributes in nodes["attributes"] for item in attributes],
+			"attribute_lengths": [len(attributes) for attributes in nodes["attributes"]],
+			"isClickable": nodes.get("isClickable", {}).get("index", []),
+			"inputValue.index": input_value["index"],
+			"inputValue.value": input_value["value"],
+			"contentDocumentIndex.index": content_documents["index"],
+			"contentDocumentIndex.value": content_documents["value"],
+			"layout.nodeIndex": document["layout"]["nodeIndex"],
+		}
+		for key, values in columns.items():
+			arrays[f"{index}.{key}"] = np.asarray(values, dtype=np.int64)
+		arrays[f"{index}.layout.bounds"] = np.asarray(document["layout"]["bounds"], dtype=np.float64).reshape(-1, 4)
+		style_count = len(tree.get("computedStyles", []))
+		styles = document["layout"].get("styles", []) if style_count else []
+		arrays[f"{index}.layout.paintOrders"] = np.asarray(document["layout"].get("paintOrders", []), dtype=np.int64)
+		arrays[f"{index}.layout.styles"] = np.asarray(styles, dtype=np.int64).reshape(len(document["layout"]["nodeIndex"]), style_count)
+		documents.append({
+			"documentURL": document["documentURL"],
+			"scrollOffsetX": document.get("scrollOffsetX", 0),
+			"scrollOffsetY": document.get("scrollOffsetY", 0),
+		})
+
+	# every array at an 8 byte aligned offset of a single block
+	placement = {}
+	size = 0
+	for name, array in arrays.items():
+		placement[name] = (size, array.dtype.str, array.shape)
+		size += -(-array.nbytes // 8) * 8
+
+	shm = shared_memory.SharedMemory(create=True, size=max(size, 8))
+	for name, array in arrays.items():
+		offset, dtype, shape = placement[name]
+		np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = array
+	manifest = {"name": shm.name, "arrays": placement, "documents": documents, "computedStyles": tree.get("computedStyles", [])}
+	return shm, manifest
+
+
+def unpack_snapshot(manifest):
+	"""The captureSnapshot-shaped tree packed by pack_snapshot, with numpy columns instead of lists where Snapshot allows."""
+	shm = shared_memory.SharedMemory(name=manifest["name"])
+	try:
+		def array(name):
+			offset, dtype, shape = manifest["arrays"][name]
+			return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+
+		blob = array("strings").tobytes()
+		offsets = array("string_offsets").tolist()
+		strings = [blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+		documents = []
+		for index, document in enumerate(manifest["documents"]):
+			column = lambda key: array(f"{index}.{key}")
+			attribute_ends = np.cumsum(column("attribute_lengths")).tolist()
+			flat_attributes = column("attributes").tolist()
+			documents.append({
+				"documentURL": document["documentURL"],
+				"scrollOffsetX": document["scrollOffsetX"],
+				"scrollOffsetY": document["scrollOffsetY"],
+				"nodes": {
+					"parentIndex": column("parentIndex"),
+					"nodeName": column("nodeName"),
+					"nodeValue": column("nodeValue"),
+					"backendNodeId": column("backendNodeId"),
+					"attributes": [flat_attributes[start:end] for start, end in zip([0] + attribute_ends, attribute_ends)],
+					"isClickable": {"index": column("isClickable")},
+					"inputValue": {"index": column("inputValue.index").tolist(), "value": column("inputValue.value").tolist()},
+					"contentDocumentIndex": {
+						"index": column("contentDocumentIndex.index").tolist(),
+						"value": column("contentDocumentIndex.value").tolist(),
+					},
+				},
+				"layout": {
+					"nodeIndex": column("layout.nodeIndex"),
+					"bounds": column("layout.bounds"),
+					"styles": column("layout.styles"),
+					"paintOrders": column("layout.paintOrders"),
+				},
+			})
+		return {"documents": documents, "strings": strings, "computedStyles": manifest["computedStyles"]}
+	finally:
+		shm.close()
+
+
+def parse_packed(manifest, metrics, viewport, main_content=True, nav_links=0):
+	"""
+	Worker side: (lines, records, groups) for a packed snapshot: the serialized lines like Crawler2.crawl()
+	returns them, the rows found by extractor.extract_records and the row of each line (chunker.line_groups).
+	"""
+	tree = unpack_snapshot(manifest)
+	snapshot = Snapshot(tree, metrics["device_pixel_ratio"])
+	mask = snapshot.cull(viewport, metrics) & ~snapshot.name_mask(black_listed_elements)
+	rows = record_rows(snapshot, mask)
+	records = extract_records(snapshot, mask, rows=rows)
+	page_element_buffer = {}
+	if main_content:
+		main, nav = content_masks(snapshot, mask, nav_links)
+		element_ids = ElementIds()
+		lines = list(iter_serialized(snapshot, main, page_element_buffer, element_ids))
+		lines += list(iter_serialized(snapshot, nav, page_element_buffer, element_ids))
+	else:
+		lines = list(iter_serialized(snapshot, mask, page_element_buffer))
+	return lines, records, line_groups(snapshot, rows, page_element_buffer, len(lines))
+
+
+class ParsePool:
+	"""
+	Parses snapshots in a process pool while the caller keeps driving the browser.
+	At most `max_pending` snapshots are queued or being parsed at once; submit() blocks past that,
+	which keeps memory bounded when capturing outruns parsing.
+	"""
+
+	def __init__(self, max_workers=None, max_pending=4):
+		self.executor = ProcessPoolExecutor(max_workers=max_workers)
+		self.slots = BoundedSemaphore(max_pending)
+
+	def submit(self, tree, metrics, viewport=Viewport.full_page(), main_content=True, nav_links=0):
+		"""Queues one captured snapshot; returns a Future of (lines, records, groups), see parse_packed."""
+		self.slots.acquire()
+		try:
+			# workers are started on demand, after the first block exists, so they share
+			# this process' resource tracker and the segment is only unlinked once, below
+			shm, manifest = pack_snapshot(tree)
+		except Exception:
+			self.slots.release()
+			raise
+
+		def release(_):
+			shm.close()
+			shm.unlink()
+			self.slots.release()
+
+		try:
+			future = self.executor.submit(parse_packed, manifest, metrics, viewport, main_content, nav_links)
+		except Exception:
+			release(None)
+			raise
+		future.add_done_callback(release)
+		return future
+
+	def close(self):
+		self.executor.shutdown()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
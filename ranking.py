@@ -0,0 +1,69 @@
+#
+# ranking.py
+#
+# BM25 ranking of serialized chunks against a question, so single-fact questions
+# only reach the model with the chunks likely to hold the answer.
+#
+
+import math
+import re
+from collections import Counter
+
+term_pattern = re.compile(r"[a-z0-9]+(?:[@.'-][a-z0-9]+)*")
+
+# serialization markup: tag names, element ids and attribute names are in every chunk and say nothing about it
+markup_pattern = re.compile(r"</?(?:link|text|button|input|img)\b|\bid=\d+|\b[\w-]+=(?=\")")
+
+stop_words = set([
+	"a", "about", "all", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+	"i", "in", "is", "it", "its", "list", "me", "my", "of", "on", "or", "our", "the", "their", "them", "this",
+	"to", "was", "what", "when", "where", "which", "who", "whom", "whose", "why", "with", "you", "your",
+])
+
+
+def terms(text):
+	"""Lowercased words of `text`, without serialization markup and stop words."""
+	text = markup_pattern.sub(" ", text.lower())
+	return [term for term in term_pattern.findall(text) if term not in stop_words]
+
+
+def bm25_scores(query, documents, k1=1.2, b=0.75):
+	"""Okapi BM25 score of every document for `query`, with idf taken over `documents` themselves."""
+	query_terms = set(terms(query))
+	document_terms = [Counter(terms(document)) for document in documents]
+	if not query_terms or not document_terms:
+		return [0.0] * len(documents)
+
+	lengths = [sum(counts.values()) for counts in document_terms]
+	average_length = sum(lengths) / len(lengths) or 1
+	count = len(documents)
+	idf = {}
+	for term in query_terms:
+		frequency = sum(1 for counts in document_terms if term in counts)
+		idf[term] = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+	scores = []
+	for counts, length in zip(document_terms, lengths):
+		score = 0.0
+		for term in query_terms:
+			occurrences = counts.get(term, 0)
+			if occurrences:
+				score += idf[term] * occurrences * (k1 + 1) / (occurrences + k1 * (1 - b + b * length / average_length))
+		scores.append(score)
+	return scores
+
+
+def select_chunks(question, chunks, top_k=2, min_share=0.5):
+	"""
+	Indices, in page order, of the chunks to ask `question` about: the `top_k` best by BM25, or every chunk when
+	the ranking isn't confident, i.e. no chunk matches the question or the top ones hold less than `min_share`
+	of the total score (the answer is likely spread over the page).
+	"""
+	if len(chunks) <= top_k:
+		return list(range(len(chunks)))
+	scores = bm25_scores(question, chunks)
+	total = sum(scores)
+	best = sorted(range(len(chunks)), key=lambda index: scores[index], reverse=True)[:top_k]
+	if total <= 0 or sum(scores[index] for index in best) < min_share * total:
+		return list(range(len(chunks)))
+	return sorted(best)
@@ -0,0 +1,987 @@
+#
+# snapshot.py
+#
+# Columnar parsing of DOMSnapshot.captureSnapshot responses, shared by every
+# crawler (combined.py, natbot.py, test2.py).
+#
+
+from itertools import chain
+from sys import platform
+
+import numpy as np
+
+black_listed_elements = set(["html", "head", "title", "meta", "iframe", "body", "script", "style", "path", "svg", "br", "::marker",])
+
+wanted_attributes = ["type", "placeholder", "aria-label", "title", "alt"]
+
+
+# computed styles Snapshot.visible() reads, one string id per layout row each
+visibility_styles = ["visibility", "opacity"]
+
+# and the ones Snapshot.occluded() reads, along with paint order
+occlusion_styles = ["position", "pointer-events"]
+
+# DOMSnapshot.captureSnapshot params per consumer. layout bounds always come back; the flags only add extra arrays
+# (DOM rects, paint order, colors) that the parser doesn't read, so only "full" (fixtures, debugging) asks for them
+capture_profiles = {
+	"agent": {"computedStyles": visibility_styles + occlusion_styles, "includeDOMRects": False, "includePaintOrder": True},
+	"qa": {"computedStyles": visibility_styles, "includeDOMRects": False, "includePaintOrder": False},
+	"full": {
+		"computedStyles": visibility_styles + occlusion_styles,
+		"includeDOMRects": True,
+		"includePaintOrder": True,
+		"includeBlendedBackgroundColors": True,
+		"includeTextColorOpacities": True,
+	},
+}
+
+
+def _entry_count(column):
+	# entries of a captureSnapshot column: a flat array, an array of arrays, or rare data ({"index": [...], ...})
+	if isinstance(column, dict):
+		return sum(_entry_count(value) for value in column.values())
+	if isinstance(column, list):
+		if column and isinstance(column[0], list):
+			return len(column) + sum(map(len, column))
+		return len(column)
+	return 1
+
+
+def payload_estimate(tree):
+	"""
+	Approximate JSON size in bytes of a captureSnapshot response, without serializing it: the string table's
+	characters plus ~5 bytes per array entry (json.dumps of the whole response costs ~0.2 s on 100k nodes).
+	"""
+	strings = tree["strings"]
+	size = sum(map(len, strings)) + 3 * len(strings)
+	for document in tree["documents"]:
+		size += 5 * sum(_entry_count(table) for table in document.values() if isinstance(table, dict))
+	return size
+
+
+def capture_snapshot(client, profile="agent", log_size=True):
+	"""DOMSnapshot.captureSnapshot over CDP session `client` with the params of capture_profiles[profile]."""
+	tree = client.send("DOMSnapshot.captureSnapshot", capture_profiles[profile])
+	# the response doesn't name its style columns, Snapshot reads them from here
+	tree["computedStyles"] = list(capture_profiles[profile]["computedStyles"])
+	if log_size:
+		node_count = sum(len(document["nodes"]["parentIndex"]) for document in tree["documents"])
+		print("Snapshot payload ({}): ~{:0.1f} KB, {} nodes".format(profile, payload_estimate(tree) / 1024, node_count))
+	return tree
+
+
+# every window/document value the crawlers need, read in a single page.evaluate round trip
+metrics_probe_js = """() => {
+	const body = document.body;
+	return {
+		device_pixel_ratio: window.devicePixelRatio,
+		scroll_x: window.pageXOffset,
+		scroll_y: window.pageYOffset,
+		width: window.screen.width,
+		height: window.screen.height,
+		inner_width: window.innerWidth,
+		inner_height: window.innerHeight,
+		scroll_height: body ? body.scrollHeight : 0,
+		offset_height: body ? body.offsetHeight : 0,
+	};
+}"""
+
+
+def page_metrics(page):
+	"""Window and document metrics for `page` (see metrics_probe_js) from one evaluate call."""
+	metrics = page.evaluate(metrics_probe_js)
+	if platform == "darwin" and metrics["device_pixel_ratio"] == 1:  # lies
+		metrics["device_pixel_ratio"] = 2
+	return metrics
+
+
+def load_full_page(page, max_steps=10, settle_timeout=1000):
+	"""
+	Scrolls to the bottom until the document stops growing, so lazy-loaded rows are in the DOM, then back to the top.
+	Each step waits for scrollHeight to actually grow (up to settle_timeout ms) instead of sleeping.
+	Returns page_metrics(page) for the loaded page.
+	"""
+	# imported here so the parser itself stays usable without playwright (bench.py replays)
+	from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+	for _ in range(max_steps):
+		height = page.evaluate("() => { window.scrollTo(0, document.body.scrollHeight); return document.body.scrollHeight; }")
+		try:
+			page.wait_for_function("height => document.body.scrollHeight > height", arg=height, timeout=settle_timeout)
+		except PlaywrightTimeoutError:
+			break
+
+	page.evaluate("window.scrollTo(0, 0)")
+	return page_metrics(page)
+
+
+def viewport_windows(metrics):
+	"""Viewport.rect policies tiling the whole document in screen-sized windows, top to bottom."""
+	top = 0
+	windows = []
+	while top < max(metrics["scroll_height"], 1):
+		windows.append(Viewport.rect(0, top, metrics["width"], top + metrics["height"]))
+		top += metrics["height"]
+	return windows
+
+
+class Viewport:
+	"""
+	Culling policy: which rectangle of the page counts as visible.
+	Build one with Viewport.current(), Viewport.screens(n), Viewport.full_page() or Viewport.rect(...).
+	"""
+
+	def __init__(self, screens=1, rect=None, full_page=False):
+		self.screen_count = screens
+		self.fixed_rect = rect
+		self.whole_page = full_page
+
+	@classmethod
+	def current(cls):
+		return cls(screens=1)
+
+	@classmethod
+	def screens(cls, count):
+		return cls(screens=count)
+
+	@classmethod
+	def full_page(cls):
+		return cls(full_page=True)
+
+	@classmethod
+	def rect(cls, left, top, right, bottom):
+		return cls(rect=(left, top, right, bottom))
+
+	def bounds(self, metrics):
+		"""(left, top, right, bottom) in page CSS pixels, or None when nothing is culled."""
+		if self.whole_page:
+			return None
+		if self.fixed_rect is not None:
+			return self.fixed_rect
+		left = metrics["scroll_x"]
+		top = metrics["scroll_y"]
+		return (left, top, left + metrics["width"], top + metrics["height"] * self.screen_count)
+
+
+def _document_columns(document, device_pixel_ratio, style_count=0):
+	# the per-node and per-layout-row columns of one document, with frame-local indices and bounds
+	nodes = document["nodes"]
+	layout = document["layout"]
+	input_value = nodes.get("inputValue", {"index": [], "value": []})
+	content_documents = nodes.get("contentDocumentIndex", {"index": [], "value": []})
+	layout_rows = len(layout["nodeIndex"])
+	paint_orders = layout.get("paintOrders", [])
+	return {
+		"parent": np.asarray(nodes["parentIndex"], dtype=np.int64),
+		"node_name": np.asarray(nodes["nodeName"], dtype=np.int64),
+		"node_value": np.asarray(nodes["nodeValue"], dtype=np.int64),
+		"backend_node_id": np.asarray(nodes["backendNodeId"], dtype=np.int64),
+		"attributes": nodes["attributes"],
+		"clickable": np.asarray(nodes.get("isClickable", {}).get("index", []), dtype=np.int64),
+		"input_index": list(input_value["index"]),
+		"input_value": list(input_value["value"]),
+		"layout_node_index": np.asarray(layout["nodeIndex"], dtype=np.int64),
+		"bounds": np.asarray(layout["bounds"], dtype=np.float64).reshape(-1, 4) / device_pixel_ratio,
+		"styles": np.asarray(layout.get("styles", []) if style_count else [], dtype=np.int64).reshape(layout_rows, style_count),
+		# -1 throughout when the snapshot was taken without includePaintOrder
+		"paint_order": np.asarray(paint_orders, dtype=np.int64) if len(paint_orders) == layout_rows else np.full(layout_rows, -1, dtype=np.int64),
+		"frame_owners": list(content_documents["index"]),
+		"frame_documents": list(content_documents["value"]),
+		"scroll": (document.get("scrollOffsetX", 0), document.get("scrollOffsetY", 0)),
+	}
+
+
+def _place_frames(columns, indices):
+	"""
+	Shifts each document's node indices past the ones before it, and moves frame bounds into page coordinates:
+	a frame document starts at its <iframe>'s box (minus its own scroll), nested frames add up.
+	Returns the document order of the concatenated nodes, each frame's right after its <iframe>, or None for a
+	single document (already in order).
+	"""
+	position = {document_index: slot for slot, document_index in enumerate(indices)}
+	node_offset = 0
+	for column in columns:
+		size = len(column["parent"])
+		column["parent"][column["parent"] >= 0] += node_offset
+		column["layout_node_index"] += node_offset
+		column["clickable"] += node_offset
+		column["input_index"] = [node_index + node_offset for node_index in column["input_index"]]
+		column["node_offset"] = node_offset
+		node_offset += size
+
+	if len(columns) == 1:
+		return None
+
+	# documents are listed parents first, so one pass in order sees every owner before its frames
+	placed = []
+	for column in columns:
+		for owner, document_index in zip(column["frame_owners"], column["frame_documents"]):
+			if document_index not in position:
+				continue
+			frame = columns[position[document_index]]
+			owner += column["node_offset"]
+			frame["parent"][frame["parent"] < 0] = owner
+			placed.append((owner, position[document_index]))
+			layout_rows = np.flatnonzero(column["layout_node_index"] == owner)
+			if len(layout_rows):
+				x, y = column["bounds"][layout_rows[0], :2]
+				scroll_x, scroll_y = frame["scroll"]
+				frame["bounds"][:, 0] += x - scroll_x
+				frame["bounds"][:, 1] += y - scroll_y
+
+	def nodes_of(slot):
+		return columns[slot]["node_offset"] + np.arange(len(columns[slot]["parent"]))
+
+	# documents without an owner keep their place at the top level, every frame goes in right after its owner
+	frame_slots = set(slot for _, slot in placed)
+	order = np.concatenate([nodes_of(slot) for slot in range(len(columns)) if slot not in frame_slots])
+	for owner, slot in placed:
+		order = np.insert(order, np.flatnonzero(order == owner)[0] + 1, nodes_of(slot))
+	return order
+
+
+class Snapshot:
+	"""
+	NumPy view over the documents of a DOMSnapshot.captureSnapshot response (the page and its iframes,
+	or just `document_index`). The per-node columns are converted once so filtering can be done on whole arrays.
+	"""
+
+	def __init__(self, tree, device_pixel_ratio=1, document_index=None):
+		documents = tree["documents"]
+		self.strings = tree["strings"]
+		self.style_names = list(tree.get("computedStyles", []))
+		style_count = len(self.style_names)
+
+		# every document by default: same-origin iframes come back as extra documents, spliced in right after
+		# the owning <iframe> node (their #document's parent), so node indices stay in document order
+		indices = list(range(len(documents))) if document_index is None else [document_index]
+		columns = [_document_columns(documents[index], device_pixel_ratio, style_count) for index in indices]
+		order = _place_frames(columns, indices)
+
+		self.url = self.strings[documents[indices[0]]["documentURL"]]
+
+		self.parent = np.concatenate([column["parent"] for column in columns])
+		self.node_name = np.concatenate([column["node_name"] for column in columns])
+		self.node_value = np.concatenate([column["node_value"] for column in columns])
+		self.backend_node_id = np.concatenate([column["backend_node_id"] for column in columns])
+		self.attributes = list(chain.from_iterable(column["attributes"] for column in columns))  # ragged, stays a list of flat [key, value, ...] lists
+		self.size = len(self.parent)
+		self.document_count = len(columns)
+		self.document_of = np.repeat(np.arange(len(columns)), [len(column["parent"]) for column in columns])
+		# new index of every concatenated node
+		position = np.arange(self.size)
+		if order is not None:
+			position[order] = np.arange(self.size)
+			self.parent = np.where(self.parent >= 0, position[self.parent], -1)[order]
+			self.node_name = self.node_name[order]
+			self.node_value = self.node_value[order]
+			self.backend_node_id = self.backend_node_id[order]
+			self.attributes = [self.attributes[index] for index in order.tolist()]
+			self.document_of = self.document_of[order]
+
+		# lower-cased tag name per node, resolved once per distinct name rather than once per node
+		name_ids, self._name_inverse = np.unique(self.node_name, return_inverse=True)
+		self._unique_names = [self.strings[name_id].lower() for name_id in name_ids.tolist()]
+		self.names = np.array(self._unique_names, dtype=object)[self._name_inverse]
+
+		self.is_clickable = np.zeros(self.size, dtype=bool)
+		self.input_value = {}
+		for column in columns:
+			self.is_clickable[position[column["clickable"]]] = True
+			for node_index, value_index in zip(position[column["input_index"]].tolist(), column["input_value"]):
+				self.input_value.setdefault(node_index, value_index)
+
+		# first layout row of every node (-1 when the node has no layout object)
+		self.layout_node_index = position[np.concatenate([column["layout_node_index"] for column in columns])]
+		self.bounds = np.concatenate([column["bounds"] for column in columns])
+		self.styles = np.concatenate([column["styles"] for column in columns])
+		self.paint_order = np.concatenate([column["paint_order"] for column in columns])
+		self.layout_cursor = np.full(self.size, -1, dtype=np.int64)
+		layout_nodes, first_rows = np.unique(self.layout_node_index, return_index=True)
+		self.layout_cursor[layout_nodes] = first_rows
+		self.has_layout = self.layout_cursor >= 0
+
+		# derived per-snapshot tables, computed on first use and shared by every pass over this snapshot
+		self._derived = {}
+
+	def name_mask(self, names):
+		"""Boolean mask of nodes whose (lower-cased) tag name is in `names`."""
+		lookup = np.array([name in names for name in self._unique_names], dtype=bool)
+		return lookup[self._name_inverse]
+
+	def attribute_pairs(self, keys):
+		"""
+		(owners, key ids, value ids) arrays for every non-empty attribute named in `keys`, in document order,
+		built in one pass over all attribute arrays.
+		"""
+		cache_key = ("attribute_pairs", tuple(keys))
+		if cache_key in self._derived:
+			return self._derived[cache_key]
+
+		keys = set(keys)
+		# the string table is deduplicated, so each wanted key resolves to (at most) one id
+		key_ids = [string_id for string_id, string in enumerate(self.strings) if string in keys]
+
+		lengths = np.fromiter(map(len, self.attributes), dtype=np.int64, count=self.size)
+		flat = np.fromiter(chain.from_iterable(self.attributes), dtype=np.int64, count=int(lengths.sum()))
+		owners = np.repeat(np.arange(self.size), lengths // 2)
+		key_column = flat[0::2]
+		value_column = flat[1::2]
+
+		wanted = np.isin(key_column, key_ids) & (value_column >= 0)
+		self._derived[cache_key] = (owners[wanted], key_column[wanted], value_column[wanted])
+		return self._derived[cache_key]
+
+	def attribute_index(self, keys):
+		"""
+		{node index: {key: value}} for the attribute names in `keys`.
+		The first occurrence of a key on a node wins, empty values are skipped.
+		"""
+		cache_key = ("attributes", tuple(keys))
+		if cache_key in self._derived:
+			return self._derived[cache_key]
+
+		owners, key_ids, value_ids = self.attribute_pairs(keys)
+		strings = self.strings
+		index = {}
+		for node_index, key_id, value_id in zip(owners.tolist(), key_ids.tolist(), value_ids.tolist()):
+			index.setdefault(node_index, {}).setdefault(strings[key_id], strings[value_id])
+		self._derived[cache_key] = index
+		return index
+
+	def string_array(self):
+		"""The string table as an object array, for gathering many strings by id at once."""
+		if "string_array" not in self._derived:
+			self._derived["string_array"] = np.array(self.strings + [""], dtype=object)[:-1]
+		return self._derived["string_array"]
+
+	def input_value_ids(self):
+		"""Per node, the string id of its inputValue (-1 when there is none)."""
+		if "input_value_ids" not in self._derived:
+			input_value_ids = np.full(self.size, -1, dtype=np.int64)
+			if self.input_value:
+				input_nodes = np.fromiter(self.input_value.keys(), dtype=np.int64, count=len(self.input_value))
+				input_value_ids[input_nodes] = np.fromiter(self.input_value.values(), dtype=np.int64, count=len(self.input_value))
+			self._derived["input_value_ids"] = input_value_ids
+		return self._derived["input_value_ids"]
+
+	def owner_nodes(self):
+		"""
+		Per node, the anchor (or else button) that collects its text and attributes when serialized:
+		the nearest one among the node itself and its ancestors, -1 when there is none.
+		"""
+		if "owners" not in self._derived:
+			nearest_anchor, nearest_button = self.nearest_ancestors("a", "button")
+			self._derived["owners"] = np.where(nearest_anchor >= 0, nearest_anchor, nearest_button)
+		return self._derived["owners"]
+
+	def node_signatures(self):
+		"""
+		Per node, an int64 row summarizing everything the serializer reads from it: name, value (or input value),
+		wanted attributes, clickability, the backend_node_id of its owner (see owner_nodes) and its bounds.
+		Strings are hashed rather than referenced by id, so rows compare across snapshots of the same page.
+		"""
+		if "signatures" in self._derived:
+			return self._derived["signatures"]
+
+		# one spare slot at the end: string id -1 hashes to 0
+		string_hash = np.fromiter(chain(map(hash, self.strings), [0]), dtype=np.int64, count=len(self.strings) + 1)
+
+		value_hash = string_hash[self.node_value]
+		if self.input_value:
+			input_nodes = np.fromiter(self.input_value.keys(), dtype=np.int64, count=len(self.input_value))
+			input_values = np.fromiter(self.input_value.values(), dtype=np.int64, count=len(self.input_value))
+			value_hash[input_nodes] ^= string_hash[input_values]
+
+		owners, key_ids, value_ids = self.attribute_pairs(wanted_attributes)
+		# weighted by position on the node, so reordered attributes count as a change too
+		ordinal = np.arange(len(owners)) - np.searchsorted(owners, owners)
+		attribute_hash = np.zeros(self.size, dtype=np.int64)
+		np.add.at(attribute_hash, owners, (string_hash[key_ids] * 31 + string_hash[value_ids]) * (ordinal + 1))
+
+		owner = self.owner_nodes()
+		owner_backend_node_id = np.where(owner >= 0, self.backend_node_id[owner], -1)
+
+		signatures = np.column_stack([
+			string_hash[self.node_name],
+			value_hash,
+			attribute_hash,
+			self.is_clickable.astype(np.int64),
+			owner_backend_node_id,
+			np.nan_to_num(self.node_bounds(), nan=-1.0).view(np.int64),
+		])
+		self._derived["signatures"] = signatures
+		return signatures
+
+	def nearest_ancestors(self, *tags):
+		"""
+		One int array per tag holding, for every node, the index of the closest node with that
+		tag among the node itself and its ancestors (-1 when there is none).
+		Pointer jumping like inherited(): unresolved nodes take over their ancestor's answer and jump twice as far.
+		"""
+		results = []
+		for tag in tags:
+			if ("nearest", tag) not in self._derived:
+				is_tag = self.name_mask([tag])
+				nearest = np.where(is_tag, np.arange(self.size), -1)
+				ancestor = self.parent.copy()
+				live = np.flatnonzero(~is_tag & (ancestor >= 0))
+				while len(live):
+					found = nearest[ancestor[live]]
+					nearest[live] = found
+					ancestor[live] = ancestor[ancestor[live]]
+					live = live[(found < 0) & (ancestor[live] >= 0)]
+				self._derived[("nearest", tag)] = nearest
+			results.append(self._derived[("nearest", tag)])
+		return results
+
+	def _parents_first_order(self):
+		# captureSnapshot emits nodes in document order, so parents normally precede their children
+		if not np.any(self.parent >= np.arange(self.size)):
+			return range(self.size)
+
+		children = [[] for _ in range(self.size)]
+		roots = []
+		for index, node_parent in enumerate(self.parent.tolist()):
+			if node_parent < 0:
+				roots.append(index)
+			else:
+				children[node_parent].append(index)
+
+		order = []
+		stack = roots[::-1]
+		while stack:
+			index = stack.pop()
+			order.append(index)
+			stack.extend(reversed(children[index]))
+		return order
+
+	def subtree_end(self):
+		"""Per node, the index of the last node in its subtree (nodes are in document order)."""
+		if "subtree_end" in self._derived:
+			return self._derived["subtree_end"]
+		parent = self.parent.tolist()
+		subtree_end = list(range(self.size))
+		for index in reversed(self._parents_first_order()):
+			node_parent = parent[index]
+			if node_parent >= 0 and subtree_end[index] > subtree_end[node_parent]:
+				subtree_end[node_parent] = subtree_end[index]
+		self._derived["subtree_end"] = subtree_end
+		return subtree_end
+
+	def subtree_sums(self, values):
+		"""Per node, the sum of `values` over its subtree, itself included."""
+		parent = self.parent.tolist()
+		sums = np.asarray(values, dtype=np.float64).tolist()
+		for index in reversed(self._parents_first_order()):
+			node_parent = parent[index]
+			if node_parent >= 0:
+				sums[node_parent] += sums[index]
+		return np.asarray(sums)
+
+	def node_bounds(self):
+		"""[x, y, width, height] per node in CSS pixels, NaN for nodes without layout."""
+		if "bounds" not in self._derived:
+			node_bounds = np.full((self.size, 4), np.nan)
+			node_bounds[self.has_layout] = self.bounds[self.layout_cursor[self.has_layout]]
+			self._derived["bounds"] = node_bounds
+		return self._derived["bounds"]
+
+	def cull(self, viewport, metrics):
+		"""Mask of visible, unoccluded nodes (see visible(), occluded()) with a layout box inside the area `viewport` selects."""
+		rect = viewport.bounds(metrics)
+		if rect is None:
+			return self.has_layout & self.visible() & ~self.occluded()
+		return self.intersects(*rect) & self.visible() & ~self.occluded()
+
+	def style_mask(self, name, values):
+		"""Mask of nodes whose computed style `name` is one of `values` (all False if it wasn't captured)."""
+		mask = np.zeros(self.size, dtype=bool)
+		if name not in self.style_names:
+			return mask
+		column = self.styles[:, self.style_names.index(name)][self.layout_cursor[self.has_layout]]
+		# a style column only holds a handful of distinct values, so match those rather than the string table
+		distinct, inverse = np.unique(column, return_inverse=True)
+		matches = np.array([self.strings[value_id] in values for value_id in distinct.tolist()], dtype=bool)
+		mask[self.has_layout] = matches[inverse]
+		return mask
+
+	def visible(self):
+		"""
+		Mask of nodes not hidden by computed styles: opacity:0 on the node or any ancestor, or visibility:hidden/collapse
+		on the node itself (inherited already, and children may set it back). display:none needs no check, such nodes
+		and their subtrees get no layout object and so never pass has_layout / cull().
+		"""
+		if "visible" not in self._derived:
+			hidden = self.inherited(self.style_mask("opacity", ["0"])) | self.style_mask("visibility", ["hidden", "collapse"])
+			self._derived["visible"] = ~hidden
+		return self._derived["visible"]
+
+	def occluded(self, max_overlays=16):
+		"""
+		Mask of nodes whose box lies entirely under a position:fixed/absolute element painted after them (cookie banners,
+		modals), where a click at their center would hit the overlay instead. Only the `max_overlays` largest overlays
+		are tested, each against all nodes at once. An overlay never occludes its own ancestors (a button's ripple,
+		a stretched link) or what shares its anchor/button, since a click on it lands there anyway.
+		All False without paint order or position styles.
+		"""
+		if "occluded" in self._derived:
+			return self._derived["occluded"]
+
+		paint_order = np.full(self.size, -1, dtype=np.int64)
+		paint_order[self.has_layout] = self.paint_order[self.layout_cursor[self.has_layout]]
+		x, y, width, height = self.node_bounds().T
+		with np.errstate(invalid="ignore"):
+			overlays = np.flatnonzero(
+				self.style_mask("position", ["fixed", "absolute"])
+				& ~self.style_mask("pointer-events", ["none"])
+				& self.visible()
+				& (paint_order >= 0)
+				& (width * height > 0)
+			)
+		overlays = overlays[np.argsort(-(width * height)[overlays], kind="stable")[:max_overlays]]
+
+		# nodes x overlays of ancestors: the walk goes up from every overlay at once, one level per pass
+		exempt = np.zeros((self.size, len(overlays)), dtype=bool)
+		columns = np.arange(len(overlays))
+		ancestor = self.parent[overlays]
+		live = np.flatnonzero(ancestor >= 0)
+		while len(live):
+			exempt[ancestor[live], columns[live]] = True
+			ancestor[live] = self.parent[ancestor[live]]
+			live = live[ancestor[live] >= 0]
+		owner = self.owner_nodes()
+		exempt |= (owner[:, None] >= 0) & (owner[:, None] == owner[overlays])
+
+		# the overlay's own subtree paints after it, so paint order alone keeps it out
+		with np.errstate(invalid="ignore"):
+			covered = (
+				(x[:, None] >= x[overlays])
+				& (y[:, None] >= y[overlays])
+				& ((x + width)[:, None] <= (x + width)[overlays])
+				& ((y + height)[:, None] <= (y + height)[overlays])
+				& (paint_order[:, None] >= 0)
+				& (paint_order[:, None] < paint_order[overlays])
+				& (self.document_of[:, None] == self.document_of[overlays])
+				& ~exempt
+			)
+		self._derived["occluded"] = covered.any(axis=1)
+		return self._derived["occluded"]
+
+	def inherited(self, mask):
+		"""
+		`mask` pushed down to every descendant. Pointer jumping: each pass doubles the ancestor distance
+		covered, so it takes log2(depth) vectorized passes and no per-node loop.
+		"""
+		covered = mask.copy()
+		ancestor = self.parent.copy()
+		live = np.flatnonzero(ancestor >= 0)
+		while len(live):
+			covered[live] |= covered[ancestor[live]]
+			ancestor[live] = ancestor[ancestor[live]]
+			live = live[ancestor[live] >= 0]
+		return covered
+
+	def intersects(self, left, top, right, bottom):
+		"""Mask of nodes whose box at least partially overlaps the given rectangle."""
+		x, y, width, height = self.node_bounds().T
+		with np.errstate(invalid="ignore"):
+			return (x < right) & (x + width >= left) & (y < bottom) & (y + height >= top)
+
+
+class Element:
+	"""One crawled node. Slotted, since big directory pages produce tens of thousands of these per crawl."""
+
+	__slots__ = (
+		"node_index",
+		"backend_node_id",
+		"node_name",
+		"node_value",
+		"node_meta",
+		"is_clickable",
+		"origin_x",
+		"origin_y",
+		"center_x",
+		"center_y",
+	)
+
+	def __init__(self, node_index, backend_node_id, node_name, node_value, node_meta, is_clickable, origin_x, origin_y, center_x, center_y):
+		self.node_index = node_index
+		self.backend_node_id = backend_node_id
+		self.node_name = node_name
+		self.node_value = node_value
+		self.node_meta = node_meta
+		self.is_clickable = is_clickable
+		self.origin_x = origin_x
+		self.origin_y = origin_y
+		self.center_x = center_x
+		self.center_y = center_y
+
+	def __repr__(self):
+		return f"Element({self.node_name!r}, node_index={self.node_index}, center=({self.center_x}, {self.center_y}))"
+
+
+def convert_name(node_name, has_click_handler):
+	if node_name == "a":
+		return "link"
+	if node_name == "input":
+		return "input"
+	if node_name == "img":
+		return "img"
+	if (
+		node_name == "button" or has_click_handler
+	):  # found pages that needed this quirk
+		return "button"
+	else:
+		return "text"
+
+
+def extract_elements(snapshot, mask):
+	"""
+	Turns the nodes selected by `mask` into Element records.
+	Returns (elements_in_view_port, child_nodes) for serialize_elements; child_nodes maps an
+	anchor/button node index to the (attribute key, value) pairs of its descendants, with key None for text.
+	"""
+	child_nodes = {}
+	elements_in_view_port = list(iter_elements(snapshot, mask, child_nodes))
+	return elements_in_view_port, child_nodes
+
+
+def iter_elements(snapshot, mask, child_nodes, emit=None):
+	"""
+	Generator form of extract_elements: yields Elements in document order for the nodes of `emit` (default: all
+	of `mask`). child_nodes is filled for the whole of `mask` before the first element is yielded, by grouped
+	gathers over owner_nodes() instead of a walk, so an anchor/button can be rendered as soon as it is yielded.
+	"""
+	strings = snapshot.string_array()
+	names = snapshot.names
+	owner = snapshot.owner_nodes()
+
+	rows = np.flatnonzero(mask)
+	row_names = names[rows]
+	row_owner = owner[rows]
+	row_value = snapshot.node_value[rows]
+
+	# wanted attributes of the selected nodes, the first occurrence of each key per node, in attribute order
+	pair_nodes, pair_keys, pair_values = snapshot.attribute_pairs(wanted_attributes)
+	selected = mask[pair_nodes]
+	pair_nodes, pair_keys, pair_values = pair_nodes[selected], pair_keys[selected], pair_values[selected]
+	_, first = np.unique(pair_nodes * len(strings) + pair_keys, return_index=True)
+	first.sort()
+	pair_nodes, pair_key_strings, pair_value_strings = pair_nodes[first], strings[pair_keys[first]], strings[pair_values[first]]
+
+	# <input type=submit> is serialized as a button, and buttons don't show their type ([button ... (button)..])
+	is_type = pair_key_strings == "type"
+	is_submit = np.zeros(snapshot.size, dtype=bool)
+	is_submit[pair_nodes[is_type & (pair_value_strings == "submit") & (names[pair_nodes] == "input")]] = True
+	keep = ~(is_type & (is_submit | (names == "button"))[pair_nodes])
+	pair_nodes, pair_key_strings, pair_value_strings = pair_nodes[keep], pair_key_strings[keep], pair_value_strings[keep]
+	pair_owner = owner[pair_nodes]
+
+	# the text and attributes an anchor/button collects from its subtree (itself included): text entries
+	# (key None) and attribute entries merged in document order, then grouped by owner
+	text_rows = np.flatnonzero((row_names == "#text") & (row_owner >= 0))
+	texts = strings[row_value[text_rows]]
+	kept_text = (texts != "|") & (texts != "•")
+	text_rows, texts = text_rows[kept_text], texts[kept_text]
+	owned_pairs = pair_owner >= 0
+	entry_nodes = np.concatenate([rows[text_rows], pair_nodes[owned_pairs]])
+	entry_owners = np.concatenate([row_owner[text_rows], pair_owner[owned_pairs]])
+	entry_keys = np.concatenate([np.full(len(text_rows), None, dtype=object), pair_key_strings[owned_pairs]])
+	entry_values = np.concatenate([texts, pair_value_strings[owned_pairs]])
+	order = np.lexsort((entry_nodes, entry_owners))
+	entry_owners = entry_owners[order]
+	entries = list(zip(entry_keys[order].tolist(), entry_values[order].tolist()))
+	starts = np.flatnonzero(np.diff(entry_owners, prepend=-2))
+	ends = np.append(starts[1:], len(entry_owners))
+	for owner_index, start, end in zip(entry_owners[starts].tolist(), starts.tolist(), ends.tolist()):
+		child_nodes.setdefault(owner_index, []).extend(entries[start:end])
+
+	# attribute values of the nodes that aren't owned, shown in their own meta
+	meta = {}
+	for node_index, value in zip(pair_nodes[~owned_pairs].tolist(), pair_value_strings[~owned_pairs].tolist()):
+		meta.setdefault(node_index, []).append(value)
+
+	# yielded: nodes without an owner, and the anchors/buttons themselves; "|" is commonly used as a separator,
+	# does not add much context - lets save ourselves some token space
+	node_names = np.where(is_submit[rows], "button", row_names)
+	value_ids = np.where(row_value >= 0, row_value, np.where(node_names == "input", snapshot.input_value_ids()[rows], -1))
+	values = np.where(value_ids >= 0, strings[value_ids], None)
+	is_owner = (node_names == "a") | (node_names == "button")
+	yielded = ((row_owner < 0) | is_owner) & ((row_value < 0) | (values != "|"))
+
+	# and of those without an owner, only the ones render_parts can show: inputs and images, buttons with
+	# attributes, anything with text. Skipping the rest here saves building tens of thousands of records
+	has_meta = np.zeros(snapshot.size, dtype=bool)
+	has_meta[pair_nodes[~owned_pairs]] = True
+	distinct_values, value_inverse = np.unique(value_ids, return_inverse=True)
+	has_text = np.array([value >= 0 and strings[value].strip() != "" for value in distinct_values.tolist()], dtype=bool)[value_inverse]
+	is_button = (node_names == "button") | snapshot.is_clickable[rows]
+	yielded &= (
+		is_owner | (node_names == "input") | (node_names == "img") | (is_button & has_meta[rows]) | has_text
+	)
+	if emit is not None:
+		yielded &= emit[rows]
+
+	# gather the yielded rows column by column, then build the records from plain python values
+	rows = rows[yielded]
+	x, y, width, height = snapshot.node_bounds()[rows].T
+	columns = zip(
+		rows.tolist(),
+		snapshot.backend_node_id[rows].tolist(),
+		node_names[yielded].tolist(),
+		values[yielded].tolist(),
+		snapshot.is_clickable[rows].tolist(),
+		x.astype(np.int64).tolist(),
+		y.astype(np.int64).tolist(),
+		(x + width / 2).astype(np.int64).tolist(),
+		(y + height / 2).astype(np.int64).tolist(),
+	)
+	for index, backend_node_id, node_name, node_value, is_clickable, origin_x, origin_y, center_x, center_y in columns:
+		yield Element(index, backend_node_id, node_name, node_value, meta.get(index, ()), is_clickable, origin_x, origin_y, center_x, center_y)
+
+
+def serialize_elements(elements_in_view_port, child_nodes, page_element_buffer):
+	"""
+	Renders elements as <link id=..>text</link> style lines, filling page_element_buffer
+	with the element behind every id handed out.
+	"""
+	elements_of_interest = []
+
+	for element in elements_in_view_port:
+		line = render_element(element, child_nodes, len(elements_of_interest))
+		if line is None:
+			continue
+		page_element_buffer[len(elements_of_interest)] = element
+		elements_of_interest.append(line)
+
+	return elements_of_interest
+
+
+class ElementIds:
+	"""
+	Element ids shared by several serialization passes over one page (scrolls, viewport windows).
+	Each backend_node_id is emitted once under a stable id; later sightings are counted in `duplicates`.
+	"""
+
+	def __init__(self):
+		self.by_backend_node_id = {}
+		self.duplicates = 0
+
+	def __contains__(self, backend_node_id):
+		return backend_node_id in self.by_backend_node_id
+
+	def __len__(self):
+		return len(self.by_backend_node_id)
+
+	def assign(self, backend_node_id):
+		element_id = len(self.by_backend_node_id)
+		self.by_backend_node_id[backend_node_id] = element_id
+		return element_id
+
+
+def iter_serialized(snapshot, mask, page_element_buffer, element_ids=None):
+	"""
+	Lazy serialize_elements straight from a snapshot: lines are yielded while elements are still being built,
+	so a caller that stops pulling early never pays for the rest of the page.
+	Pass the same ElementIds to several calls to number elements across passes and skip repeats.
+	"""
+	if element_ids is None:
+		element_ids = ElementIds()
+
+	child_nodes = {}
+	for element in iter_elements(snapshot, mask, child_nodes):
+		if element.backend_node_id in element_ids:
+			element_ids.duplicates += 1
+			continue
+		line = render_element(element, child_nodes, len(element_ids))
+		if line is None:
+			continue
+		page_element_buffer[element_ids.assign(element.backend_node_id)] = element
+		yield line
+
+
+class IncrementalSerializer:
+	"""
+	iter_serialized for repeated crawls of the same page. Keeps the previous crawl's parsed elements keyed by
+	backend_node_id and only re-parses nodes whose signature (see Snapshot.node_signatures) changed or that
+	entered the culled area, plus the anchors/buttons that collect text from them.
+	After each serialize(), `delta` holds what changed since the previous crawl: "added" and "changed" lines
+	(numbered as in the new full view) and the backend_node_ids of "removed" elements.
+	"""
+
+	# column of node_signatures holding the owner's backend_node_id
+	owner_column = 4
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		# previous snapshot, sorted by backend_node_id
+		self.backend_node_ids = np.empty(0, dtype=np.int64)
+		self.signatures = None
+		self.in_mask = np.empty(0, dtype=bool)
+		# backend_node_id -> (element, render_parts output) for every node in the previous mask, None when it yielded no element
+		self.parsed = {}
+		self.delta = {"added": [], "changed": [], "removed": []}
+		self.reparsed = 0
+
+	def changed_nodes(self, snapshot, mask):
+		"""Mask of nodes that are new, whose signature changed, or that moved in or out of `mask`."""
+		signatures = snapshot.node_signatures()
+		backend_node_id = snapshot.backend_node_id
+		previous = self.backend_node_ids
+		if len(previous) == 0:
+			return np.ones(snapshot.size, dtype=bool)
+
+		position = np.minimum(np.searchsorted(previous, backend_node_id), len(previous) - 1)
+		found = previous[position] == backend_node_id
+		changed = ~found
+		matched = position[found]
+		changed[found] = np.any(self.signatures[matched] != signatures[found], axis=1) | (self.in_mask[matched] != mask[found])
+		# nodes of the previous mask that the previous iterator never reached have nothing cached
+		walked = np.isin(previous, np.fromiter(self.parsed.keys(), dtype=np.int64, count=len(self.parsed)))
+		changed[found] |= self.in_mask[matched] & ~walked[matched]
+
+		# an owner whose old children moved away or disappeared renders differently as well
+		removed = ~np.isin(previous, backend_node_id)
+		old_owners = np.concatenate([
+			self.signatures[removed, self.owner_column],
+			self.signatures[position[changed & found], self.owner_column],
+		])
+		changed |= np.isin(backend_node_id, old_owners[old_owners >= 0])
+
+		# and so does every owner with a changed node among the ones it collects
+		owner = snapshot.owner_nodes()
+		changed[owner[changed & (owner >= 0)]] = True
+		return changed
+
+	def serialize(self, snapshot, mask, page_element_buffer, first=None):
+		"""
+		Diffs `snapshot` against the previous call and returns an iterator over the full serialized view,
+		numbered from 0 like iter_serialized. Flagged nodes are only re-parsed once the iterator reaches them,
+		so a caller that stops pulling early never builds the rest; `delta` is complete once it is exhausted.
+		Nodes of `first`, if given, are listed before the rest of `mask`, each part in document order.
+		"""
+		changed = self.changed_nodes(snapshot, mask)
+		owner = snapshot.owner_nodes()
+		reparse = mask & (changed | ((owner >= 0) & changed[owner]))
+		self.reparsed = int(np.count_nonzero(reparse))
+
+		previous = self.parsed
+		order = np.argsort(snapshot.backend_node_id)
+		self.backend_node_ids = snapshot.backend_node_id[order]
+		self.signatures = snapshot.node_signatures()[order]
+		self.in_mask = mask[order]
+		# filled as the iterator walks; changed_nodes re-parses whatever it never reached
+		self.parsed = {}
+		self.delta = {"added": [], "changed": [], "removed": []}
+
+		parts = [mask] if first is None else [mask & first, mask & ~first]
+		return self._iter_lines(snapshot, parts, reparse, previous, self.parsed, self.delta, page_element_buffer)
+
+	@staticmethod
+	def _iter_lines(snapshot, parts, reparse, previous, parsed, delta, page_element_buffer):
+		element_id = 0
+		for part in parts:
+			rows = np.flatnonzero(part)
+			child_nodes = {}
+			fresh = iter_elements(snapshot, reparse, child_nodes, emit=part & reparse)
+			next_fresh = None
+			for index, backend_node_id, is_reparsed in zip(
+				rows.tolist(), snapshot.backend_node_id[rows].tolist(), reparse[rows].tolist()
+			):
+				if is_reparsed:
+					# iter_elements yields a subset of these rows, in the same order
+					if next_fresh is None or next_fresh.node_index < index:
+						next_fresh = next(fresh, None)
+					if next_fresh is not None and next_fresh.node_index == index:
+						entry = (next_fresh, render_parts(next_fresh, child_nodes))
+					else:
+						entry = None
+				else:
+					entry = previous.get(backend_node_id)
+					if entry is not None:
+						entry[0].node_index = index
+				parsed[backend_node_id] = entry
+
+				if not _is_shown(entry):
+					continue
+				line = format_element(entry[1], element_id)
+				if is_reparsed:
+					before = previous.get(backend_node_id)
+					if not _is_shown(before):
+						delta["added"].append(line)
+					elif before[1] != entry[1]:
+						delta["changed"].append(line)
+				page_element_buffer[element_id] = entry[0]
+				element_id += 1
+				yield line
+
+		delta["removed"] = [
+			backend_node_id
+			for backend_node_id, entry in previous.items()
+			if _is_shown(entry) and not _is_shown(parsed.get(backend_node_id))
+		]
+
+
+def _is_shown(entry):
+	# entry of IncrementalSerializer.parsed that renders to a line
+	return entry is not None and entry[1] is not None
+
+
+def render_parts(element, child_nodes):
+	"""(converted node name, meta, inner text) for one element, or None when it carries nothing worth showing."""
+	# lets filter further to remove anything that does not hold any text nor has click handlers + merge text from leaf#text nodes with the parent
+	node_index = element.node_index
+	node_name = element.node_name
+	node_value = element.node_value
+	is_clickable = element.is_clickable
+	meta_data = element.node_meta
+
+	inner_text = f"{node_value} " if node_value else ""
+	meta = ""
+
+	if node_index in child_nodes:
+		meta_data = list(meta_data)
+		for entry_key, entry_value in child_nodes[node_index]:
+			if entry_key is not None:
+				meta_data.append(f'{entry_key}="{entry_value}"')
+			else:
+				inner_text += f"{entry_value} "
+
+	if meta_data:
+		meta_string = " ".join(meta_data)
+		meta = f" {meta_string}"
+
+	if inner_text != "":
+		inner_text = f"{inner_text.strip()}"
+
+	converted_node_name = convert_name(node_name, is_clickable)
+
+	# not very elegant, more like a placeholder
+	if (
+		(converted_node_name != "button" or meta == "")
+		and converted_node_name != "link"
+		and converted_node_name != "input"
+		and converted_node_name != "img"
+		and converted_node_name != "textarea"
+	) and inner_text.strip() == "":
+		return None
+
+	return converted_node_name, meta, inner_text
+
+
+def format_element(parts, element_id):
+	"""The serialized line for render_parts output under `element_id`."""
+	converted_node_name, meta, inner_text = parts
+	if inner_text != "":
+		return f"""<{converted_node_name} id={element_id}{meta}>{inner_text}</{converted_node_name}>"""
+	return f"""<{converted_node_name} id={element_id}{meta}/>"""
+
+
+def render_element(element, child_nodes, element_id):
+	"""The serialized line for one element, or None when it carries nothing worth showing."""
+	parts = render_parts(element, child_nodes)
+	return None if parts is None else format_element(parts, element_id)
+
@@ -0,0 +1,100 @@
+#
+# tokens.py
+#
+# Token-based prompt budgets. Counts come from tiktoken (see req.txt); without it they
+# fall back to a deliberately pessimistic characters-per-token estimate.
+#
+
+# context window (prompt + completion) per completion model
+context_lengths = {
+	"text-davinci-003": 4097,
+	"text-davinci-002": 4097,
+	"text-curie-001": 2049,
+	"text-babbage-001": 2049,
+	"text-ada-001": 2049,
+}
+
+# tokens kept free for the difference between counting lines one by one and counting the joined prompt
+budget_margin = 16
+
+# fallback estimate without tiktoken: markup, ids and phone numbers run at ~2-2.5 characters per token
+# (not the ~4 of English prose), and an over-long prompt fails the request, so assume the worst of them
+fallback_chars_per_token = 2
+
+
+def _load_encoding(model):
+	try:
+		import tiktoken
+	except ImportError:
+		return None
+	try:
+		return tiktoken.encoding_for_model(model)
+	except KeyError:
+		return tiktoken.get_encoding("p50k_base")
+
+
+class TokenCounter:
+	"""
+	Token counts for one model. Counts of single lines are cached (up to `cache_size` of them), since
+	serialized elements repeat across crawls of a page, chunks and scrolls.
+	"""
+
+	def __init__(self, model="text-davinci-003", cache_size=200000):
+		self.model = model
+		self.cache_size = cache_size
+		self.cache = {}
+		self._encoding = None
+		self._loaded = False
+
+	@property
+	def encoding(self):
+		# loaded on first use, tiktoken may have to fetch the BPE ranks
+		if not self._loaded:
+			self._encoding = _load_encoding(self.model)
+			self._loaded = True
+		return self._encoding
+
+	def count(self, text):
+		if self.encoding is None:
+			return -(-len(text) // fallback_chars_per_token)
+		return len(self.encoding.encode(text, disallowed_special=()))
+
+	def count_line(self, line):
+		"""count() of one serialized element line, cached."""
+		tokens = self.cache.get(line)
+		if tokens is None:
+			if len(self.cache) >= self.cache_size:
+				self.cache.clear()
+			tokens = self.cache[line] = self.count(line)
+		return tokens
+
+	def split(self, text, budget):
+		"""`text` cut into consecutive pieces of at most `budget` tokens."""
+		if self.encoding is None:
+			size = budget * fallback_chars_per_token
+			return [text[start:start + size] for start in range(0, max(len(text), 1), size)]
+		encoded = self.encoding.encode(text, disallowed_special=())
+		return [self.encoding.decode(encoded[start:start + budget]) for start in range(0, max(len(encoded), 1), budget)]
+
+	def prompt_budget(self, prompt, max_tokens):
+		"""Tokens left for page content in `prompt` (the template already filled in, except the content) when `max_tokens` are requested."""
+		return context_lengths.get(self.model, 4097) - self.count(prompt) - max_tokens - budget_margin
+
+
+def take_within_tokens(lines, budget, counter, separator="\n"):
+	"""
+	Joins whole lines while they fit in `budget` tokens, cuts the first one that doesn't, and stops pulling
+	from `lines` right there.
+	"""
+	taken = []
+	used = 0
+	for line in lines:
+		cost = counter.count_line(line) + (1 if taken else 0)
+		if used + cost > budget:
+			remaining = budget - used - (1 if taken else 0)
+			if remaining > 0:
+				taken.append(counter.split(line, remaining)[0])
+			break
+		taken.append(line)
+		used += cost
+	return separator.join(taken)